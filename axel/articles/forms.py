@@ -119,10 +119,9 @@ class PDFUploadForm(forms.Form):
     def generate_temp_article(text):
         # TODO: make this Article class method
         from axel.articles.models import Article, Venue, TestCollocations
-        import json
         venue = Venue.objects.get(acronym='SIGIR')
         stemmed_text = nlp.Stemmer.stem_wordnet(text)
-        index = json.dumps(nlp.build_ngram_index(stemmed_text))
+        index = nlp.build_ngram_index(stemmed_text)
         article = Article(text=text, cluster_id='CS_COLLOCS', venue=venue, year=2013,
                           stemmed_text=stemmed_text, index=index)
         # TODO: extract title and abstract
@@ -0,0 +1,30 @@
+"""Add the sentence boundaries column to an existing articles table and fill it"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from axel.articles.models import Article
+from axel.libs.utils import get_sentence_ends, print_progress
+
+
+class Command(BaseCommand):
+    help = 'Adds Article._sentence_ends column created by syncdb only for new tables and fills it'
+
+    def handle(self, *args, **options):
+        field = Article._meta.get_field('_sentence_ends')
+        table = Article._meta.db_table
+        cursor = connection.cursor()
+        columns = [column[0] for column in
+                   connection.introspection.get_table_description(cursor, table)]
+        if field.column not in columns:
+            print 'Adding column...'
+            with transaction.atomic():
+                cursor.execute('ALTER TABLE {0} ADD COLUMN {1} {2} NULL'.format(
+                    connection.ops.quote_name(table), connection.ops.quote_name(field.column),
+                    field.db_type(connection)))
+
+        print 'Filling sentence boundaries...'
+        for article in print_progress(Article.objects.filter(_sentence_ends__isnull=True)
+                                      .only('text')):
+            Article.objects.filter(pk=article.pk).update(
+                _sentence_ends=get_sentence_ends(article.text))
+        print 'Filled successfully'
@@ -0,0 +1,77 @@
+"""Compare n-gram count correction against the per-candidate index rebuild"""
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from axel.articles.models import Article
+from axel.libs import nlp
+
+
+def _legacy_update_ngram_counts(ngrams, index):
+    """
+    Previous implementation of nlp._update_ngram_counts,
+    rebuilds n-gram index of every candidate to find its sub-n-grams.
+    Both implementations are timed without the print_timing wrapper.
+    """
+    ngrams = [u' '.join(ngram) for ngram in ngrams]
+    ngrams.sort(key=lambda ngram: len(ngram), reverse=True)
+    ngram_counts = {}
+    for ngram in ngrams:
+        ngram_counts[ngram] = index[ngram]
+    for ngram in ngrams:
+        for ngram1 in sorted(nlp._build_ngram_index_untimed(ngram).keys(),
+                             key=lambda x: len(x))[:-1]:
+            if ngram1 in ngram_counts:
+                ngram_counts[ngram1] -= ngram_counts[ngram]
+    return ngram_counts
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--article', '-a', action='store', dest='article', type='int',
+            help='article id to benchmark on'),
+        make_option('--cluster', '-c', action='store', dest='cluster',
+            help='cluster name to benchmark on'),
+        make_option('--repeat', '-r', action='store', dest='repeat', type='int', default=3,
+            help='number of runs per article, best run is reported'),
+        )
+    help = 'Benchmarks n-gram count correction of the collocation extraction'
+
+    def _time(self, func, repeat, *args):
+        best = None
+        for _ in range(repeat):
+            time1 = time.time()
+            result = func(*args)
+            elapsed = time.time() - time1
+            if best is None or elapsed < best:
+                best = elapsed
+        return result, best
+
+    def handle(self, *args, **options):
+        articles = Article.objects.all()
+        if options['article']:
+            articles = articles.filter(id=options['article'])
+        elif options['cluster']:
+            articles = articles.filter(cluster_id=options['cluster'])
+        else:
+            raise CommandError("need to specify article or cluster")
+
+        legacy_total = new_total = 0
+        for article in articles.iterator():
+            index = article.index
+            ngrams = nlp._generate_possible_ngrams(nlp._bigram_candidates(index), index)
+            legacy, legacy_time = self._time(_legacy_update_ngram_counts, options['repeat'],
+                                             ngrams, index)
+            new, new_time = self._time(nlp._update_ngram_counts_untimed, options['repeat'],
+                                       ngrams, index)
+            if legacy != new:
+                raise CommandError("counts differ for article {0}".format(article.id))
+            legacy_total += legacy_time
+            new_total += new_time
+            print '{0}: {1} candidates, {2:.3f}ms -> {3:.3f}ms'.format(
+                article.id, len(ngrams), legacy_time * 1000, new_time * 1000)
+
+        if new_total:
+            print 'Total: {0:.3f}ms -> {1:.3f}ms, {2:.1f}x'.format(
+                legacy_total * 1000, new_total * 1000, legacy_total / new_total)
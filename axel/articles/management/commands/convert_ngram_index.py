@@ -0,0 +1,36 @@
+"""Convert n-gram indexes stored as JSON text to the compact binary format"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from axel.articles.models import Article
+from axel.libs.utils import print_progress
+
+
+# column type changes, SQLite stores binary values in a text column as is
+ALTER_COLUMN_SQL = {
+    'postgresql': 'ALTER TABLE {table} ALTER COLUMN {column} DROP DEFAULT, '
+                  'ALTER COLUMN {column} DROP NOT NULL, '
+                  'ALTER COLUMN {column} TYPE bytea USING convert_to({column}, \'UTF8\')',
+    'mysql': 'ALTER TABLE {table} MODIFY {column} LONGBLOB NULL',
+}
+
+
+class Command(BaseCommand):
+    help = 'Changes Article.index column to binary and converts JSON indexes to the binary format'
+
+    def handle(self, *args, **options):
+        field = Article._meta.get_field('index')
+        vendor = connection.vendor
+        if vendor in ALTER_COLUMN_SQL:
+            print 'Changing column type...'
+            sql = ALTER_COLUMN_SQL[vendor].format(
+                table=connection.ops.quote_name(Article._meta.db_table),
+                column=connection.ops.quote_name(field.column))
+            with transaction.atomic():
+                connection.cursor().execute(sql)
+
+        print 'Converting indexes...'
+        # empty legacy values become NULL, JSON ones are converted by the field on load
+        for article in print_progress(Article.objects.only('index')):
+            Article.objects.filter(pk=article.pk).update(index=article.index)
+        print 'Converted successfully'
@@ -7,6 +7,7 @@ from django.core.management.base import BaseCommand, CommandError
 from django.core.files import File
 from test_collection.models import TaggedCollection
 from axel.articles.models import Article, Venue, ArticleCollocation
+from axel.articles.utils.search import ConceptIndex
 from axel.stats.models import SWCollocations
 
 
@@ -22,7 +23,11 @@ class Command(BaseCommand):
         make_option('--year', '-y', action='store', dest='year',
             help='Conference year'),
         make_option('--cluster', '-c', action='store', dest='cluster',
-            help='cluster name')
+            help='cluster name'),
+        make_option('--bulk', action='store_true', dest='bulk', default=False,
+            help='populate collocations with bulk inserts'),
+        make_option('--processes', '-p', action='store', dest='processes', type='int',
+            help='number of worker processes to extract collocations with, implies --bulk')
         )
 
     help = 'Imports PDFs from the specified directory'
@@ -53,10 +58,16 @@ class Command(BaseCommand):
                     with open(full_path, 'rb') as pdf:
                         article.pdf.save(name, File(pdf), save=True)
                     article.save()
+                    # store POS tagged sentences for the collocation features
+                    _ = article.tagged_sentences
                     article_ids.append(article.id)
 
         print 'Starting collocation population...'
-        Article.create_collocations(cluster)
+        Article.create_collocations(cluster, bulk=options['bulk'],
+                                    processes=options['processes'])
+
+        print 'Indexing concepts...'
+        print 'Indexed {0} articles'.format(ConceptIndex(cluster).add_articles(article_ids))
 
         print 'Starting merging... (dashed ngrams)'
         all_ngrams = set(ArticleCollocation.objects.values_list('ngram', flat=True).distinct())
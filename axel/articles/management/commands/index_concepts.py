@@ -0,0 +1,28 @@
+"""Build the inverted concept index for ranked conceptual search"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from axel.articles.models import CLUSTERS_DICT
+from axel.articles.utils.search import ConceptIndex
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--cluster', '-c', action='store', dest='cluster',
+                    help='cluster id for article type'),
+        make_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                    help='index all articles from scratch instead of adding new ones'),
+    )
+    help = 'Adds articles with collocations to the concept search index'
+
+    def handle(self, *args, **options):
+        cluster_id = options['cluster']
+        if cluster_id not in CLUSTERS_DICT:
+            raise CommandError("need to specify cluster id")
+        index = ConceptIndex(cluster_id)
+        if options['rebuild']:
+            added = index.rebuild()
+        else:
+            added = index.add_articles()
+        print 'Indexed {0} articles, {1} in total'.format(added, len(index))
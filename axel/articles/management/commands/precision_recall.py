@@ -65,31 +65,17 @@ class Command(BaseCommand):
 
             correct_objects = self.article_rel_dict[unicode(article)][1]
             incorrect_objects = self.article_rel_dict[unicode(article)][0]
-            article_ngrams = list(self.Model.objects.filter(article=article).values_list('ngram', flat=True))
-            links_graph = article.wikilinks_graph
-
-            for i, ngram1 in enumerate(article_ngrams):
-                try:
-                    ngram1_links = zip(*links_graph.edges(nbunch=[ngram1]))[1]
-                except IndexError:
-                    ngram1_links = set()
-                for j in range(i+1, len(article_ngrams)):
-                    ngram2 = article_ngrams[j]
-                    try:
-                        ngram2_links = zip(*links_graph.edges(nbunch=[ngram2]))[1]
-                    except IndexError:
-                        ngram2_links = set()
-
-                    if ngram1 in correct_objects and ngram2 in correct_objects:
-                        attr = 'valid'
-                    elif ngram1 in incorrect_objects and ngram2 in incorrect_objects:
-                        attr = 'invalid'
-                    else:
-                        attr = 'multi'
-                    if ngram1 in ngram2_links or ngram2 in ngram1_links:
-                        #if attr == 'multi' or attr == 'invalid':
-                        #    print ngram1, ngram2
-                        relation_distibution[attr] += 1
+            # every linked pair of the article n-grams is an edge of the graph
+            for ngram1, ngram2 in article.wikilinks_graph.edges():
+                if ngram1 in correct_objects and ngram2 in correct_objects:
+                    attr = 'valid'
+                elif ngram1 in incorrect_objects and ngram2 in incorrect_objects:
+                    attr = 'invalid'
+                else:
+                    attr = 'multi'
+                #if attr == 'multi' or attr == 'invalid':
+                #    print ngram1, ngram2
+                relation_distibution[attr] += 1
         print relation_distibution
 
     def _dbpedia_cc_size_calculation(self):
@@ -293,6 +279,8 @@ class Command(BaseCommand):
             correct_ngrams_set = self.article_rel_dict[unicode(article)][1]
             identified_correct = set()
             correct_ngrams = make_trie(correct_ngrams_set)
+            # sentences of the stored tags also split on ';' and abbreviations,
+            # sent_tokenize is kept so the training data and results stay reproducible
             for sentence in nltk.sent_tokenize(article.text):
                 sentence_tagged = nltk.pos_tag(nltk.regexp_tokenize(sentence, nlp.Stemmer.TOKENIZE_REGEXP))
                 sent_tree = Tree('S', [])
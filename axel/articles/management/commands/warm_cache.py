@@ -0,0 +1,74 @@
+"""Precompute cached properties of article collocations"""
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from axel.articles.models import Article, ArticleCollocation, CLUSTERS_DICT, warm_cache_task
+from axel.articles.utils.db import db_cache
+from axel.libs.utils import pool_map
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--cluster', '-c', action='store', dest='cluster',
+                    help='cluster id for article type'),
+        make_option('--fields', '-f', action='store', dest='fields',
+                    default=','.join(ArticleCollocation.CACHED_PROPERTIES),
+                    help='comma separated cached properties to compute'),
+        make_option('--batch-size', '-b', action='store', dest='batch_size', type='int',
+                    default=20, help='number of articles written per transaction'),
+        make_option('--start-after', '-s', action='store', dest='start_after', type='int',
+                    help='resume after the article with this id'),
+        make_option('--processes', '-p', action='store', dest='processes', type='int',
+                    help='number of worker processes, each article is written by its worker'),
+    )
+    help = 'Computes missing cached properties of the cluster collocations article by article'
+
+    def handle(self, *args, **options):
+        cluster_id = options['cluster']
+        if not cluster_id:
+            raise CommandError("need to specify cluster id")
+        model = CLUSTERS_DICT[cluster_id]
+        fields = tuple(options['fields'].split(','))
+        unknown = set(fields).difference(ArticleCollocation.CACHED_PROPERTIES)
+        if unknown:
+            raise CommandError("unknown cached properties: {0}".format(', '.join(unknown)))
+
+        # stable order, so an interrupted run can be resumed with --start-after
+        articles = Article.objects.filter(cluster_id=cluster_id).order_by('id')
+        if options['start_after']:
+            articles = articles.filter(id__gt=options['start_after'])
+        article_ids = list(articles.values_list('id', flat=True))
+        batch_size = options['batch_size']
+
+        time1 = time.time()
+        if options['processes']:
+            self._warm_parallel(cluster_id, article_ids, fields, batch_size, options['processes'])
+        else:
+            self._warm(model, article_ids, fields, batch_size)
+        print 'Finished in {0:.1f}s'.format(time.time() - time1)
+
+    def _report(self, processed, total, warmed, article_id):
+        print '{0}/{1} articles, {2} collocations updated, last article id {3}'.format(
+            processed, total, warmed, article_id)
+
+    def _warm(self, model, article_ids, fields, batch_size):
+        warmed = 0
+        for i in range(0, len(article_ids), batch_size):
+            batch_ids = article_ids[i:i + batch_size]
+            # one UPDATE per collocation, whole batch in one transaction
+            with db_cache.deferred():
+                for article in Article.objects.filter(id__in=batch_ids).order_by('id'):
+                    warmed += model.warm_cache(article, fields)
+            self._report(i + len(batch_ids), len(article_ids), warmed, batch_ids[-1])
+
+    def _warm_parallel(self, cluster_id, article_ids, fields, batch_size, processes):
+        # collocations belong to a single article, so workers never write the same row
+        tasks = ((cluster_id, article_id, fields) for article_id in article_ids)
+        warmed = 0
+        results = pool_map(warm_cache_task, tasks, processes, batch_size, database=True)
+        for i, (article_id, count) in enumerate(results, 1):
+            warmed += count
+            if not i % batch_size or i == len(article_ids):
+                self._report(i, len(article_ids), warmed, article_id)
@@ -0,0 +1,28 @@
+"""Manage the shared cache of Wikipedia and DBpedia responses"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from axel.libs.wiki import response_cache
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--dump', action='store', dest='dump',
+                    help='file to write all cached responses to'),
+        make_option('--load', action='store', dest='load',
+                    help='file to pre-seed the cache from, e.g. for offline test runs'),
+        make_option('--evict', action='store_true', dest='evict', default=False,
+                    help='remove expired and the oldest responses above the size limit'),
+    )
+    help = 'Dumps, pre-seeds or cleans the response cache used to build article graphs'
+
+    def handle(self, *args, **options):
+        if not (options['dump'] or options['load'] or options['evict']):
+            raise CommandError("need to specify dump, load or evict")
+        if options['load']:
+            print 'Loaded {0} responses'.format(response_cache.load(options['load']))
+        if options['evict']:
+            print 'Evicted {0} responses'.format(response_cache.evict())
+        if options['dump']:
+            print 'Dumped {0} responses'.format(response_cache.dump(options['dump']))
@@ -1,20 +1,25 @@
-import json
+from collections import defaultdict
+from contextlib import contextmanager
+import hashlib
 import os
 
 from django.conf import settings
 from django.contrib.contenttypes import generic
-from django.db import models
+from django.db import connection, models, transaction
 from django.db.models import F, Sum
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import post_init, pre_delete, pre_save, post_save
 from django.dispatch import receiver
 
 from jsonfield import JSONField
 from test_collection.models import TaggedCollection
 
-from .utils.db import db_cache
-from axel.libs import nlp
-from axel.libs.utils import get_contexts, get_contexts_ngrams, print_progress
-from axel.stats.models import SWCollocations, Collocations
+from .utils.concepts_index import concepts_changed
+from .utils.db import db_cache, NgramIndexField, OffsetArrayField
+from axel.libs import nlp, wiki
+from axel.libs.matcher import NgramMatcher
+from axel.libs.utils import ContextEngine, get_contexts, get_contexts_ngrams, get_sentence_ends, \
+    pool_map, print_progress
+from axel.stats.models import SWCollocations, Collocations, bulk_create_collocations
 import axel.stats.scores as scores
 
 
@@ -52,7 +57,9 @@ class Article(models.Model):
     pdf = models.FileField(upload_to=pdf_upload_to)
     stemmed_text = models.TextField(default='')
     text = models.TextField(default='')
-    index = models.TextField(default='')
+    # offsets right after sentence boundaries of the text, see sentence_ends
+    _sentence_ends = OffsetArrayField()
+    index = NgramIndexField()
     index_nonstemmed = JSONField()
     cluster_id = models.CharField(max_length=255)
     # n-gram index of wikipedia pages from the biggest connected components
@@ -78,13 +85,47 @@ class Article(models.Model):
         """
         return CLUSTERS_DICT[self.cluster_id]
 
+    @property
+    def sentence_ends(self):
+        """
+        Sorted offsets right after the sentence boundaries of the text,
+        stored with the article and recomputed if the text was changed since loading
+        :rtype: array
+        """
+        if self._sentence_ends is None or \
+                getattr(self, '_sentence_ends_text', None) is not self.text:
+            self._sentence_ends = get_sentence_ends(self.text)
+            self._sentence_ends_text = self.text
+        return self._sentence_ends
+
+    def bigger_ngrams(self, ngram):
+        """
+        Article collocations containing the ngram,
+        all collocations of the article are matched against each other once
+        :rtype: list
+        """
+        if not hasattr(self, '_bigger_ngrams'):
+            ngrams = list(self.articlecollocation_set.values_list('ngram', flat=True))
+            self._bigger_ngrams = NgramMatcher(ngrams).containing(ngrams)
+        return self._bigger_ngrams.get(ngram, [])
+
+    @property
+    def tagged_sentences(self):
+        """
+        Part-of-speech tagged sentences of the text, shared by the article collocations
+        :rtype: TaggedSentences
+        """
+        tagged = getattr(self, '_tagged_sentences', None)
+        if tagged is None or tagged.text != self.text:
+            self._tagged_sentences = tagged = TaggedText.get_tagged_sentences(self)
+        return tagged
+
     def dbpedia_graph(self, redirects=True):
         """
         Generate a dbpedia category TREE using networkx
         :rtype: nx.Graph
         """
         import tempfile
-        import requests
         from networkx.readwrite import json_graph
         tmpdir = tempfile.gettempdir()
         if redirects:
@@ -96,61 +137,32 @@ class Article(models.Model):
             stop_uris_set = open(settings.ABS_PATH('stop_uri.txt')).read().split()
             stop_uris_set = set([x.split('/')[-1] for x in stop_uris_set])
 
-            def recurse_populate_graph(resource, graph, depth):
+            def expand(resource):
                 if resource in stop_uris_set:
-                    return
-                if depth == 0:
-                    return
+                    return []
                 if 'Category' in resource:
-                    query = u'SELECT ?broader, ?related, ?broaderof WHERE' \
-                            u' {{{{ <http://dbpedia.org/resource/{0}> skos:broader ?broader }}' \
-                            u' UNION {{ ?broaderof skos:broader <http://dbpedia.org/resource/{0}> }}' \
-                            u' UNION {{ ?related skos:related <http://dbpedia.org/resource/{0}> }}' \
-                            u' UNION {{ <http://dbpedia.org/resource/{0}> skos:related ?related }}}}'.format(resource)
-
+                    return [(resource, parent_resource, rel_type) for rel_type, parent_resource
+                            in wiki.category_relations(resource)]
+                if resource == 'cumulative gain':
+                    resource = 'Discounted_cumulative_gain'
+                elif resource == 'world wide web conference':
+                    resource = 'International_World_Wide_Web_Conference'
+                results = wiki.wiki_categories(resource)
+                if results is None:
+                    print 'missing', resource
                     results = []
-                    sparql = SPARQLWrapper("http://dbpedia.org/sparql")
-                    sparql.setReturnFormat(JSON)
-                    sparql.setQuery(query)
-                    results.extend(sparql.query().convert()['results']['bindings'])
-                    for result in results:
-                        for rel_type, value in result.iteritems():
-                            uri = value['value']
-                            parent_resource = uri.split('/')[-1]
-                            #print '  ' * (3 - depth), resource, '->', parent_resource
-                            graph.add_edge(resource, parent_resource, type=rel_type)
-                            recurse_populate_graph(parent_resource, graph, depth-1)
-                else:
-                    if resource == 'cumulative gain':
-                        resource = 'Discounted_cumulative_gain'
-                    elif resource == 'world wide web conference':
-                        resource = 'International_World_Wide_Web_Conference'
-                    wiki_cat_query = u'http://en.wikipedia.org/w/api.php?action=query&titles={0}&prop=categories&cllimit=50&clshow=!hidden&format=json&redirects'
-                    results = json.loads(requests.get(wiki_cat_query.format(resource)).text)['query']['pages'].values()[0]
-                    if 'missing' in results:
-                        results = json.loads(requests.get(wiki_cat_query.format(resource.title())).text)['query']['pages'].values()[0]
-                        if 'missing' in results:
-                            print results, resource
-                            results = []
-                        else:
-                            results = [c['title'].replace(' ', '_') for c in results['categories']]
-                    else:
-                        results = [c['title'].replace(' ', '_') for c in results['categories']]
-                    rel_type = "subject"
-                    for parent_resource in results:
-                        #print '  ' * (3 - depth), resource, '->', parent_resource
-                        graph.add_edge(resource, parent_resource, type=rel_type)
-                        recurse_populate_graph(parent_resource, graph, depth-1)
+                return [(resource, parent_resource, "subject") for parent_resource in results]
 
             import networkx as nx
-            from SPARQLWrapper import SPARQLWrapper, JSON
 
             graph = nx.Graph()
             ngrams = set(self.articlecollocation_set.values_list('ngram', flat=True))
             ngrams = self.CollocationModel.COLLECTION_MODEL.objects.filter(ngram__in=ngrams)
-            for ngram in ngrams:
-                if 'dbpedia' in ngram.source or (redirects and 'wiki_redirect' in ngram.source):
-                    recurse_populate_graph(ngram.ngram, graph, 2)
+            seeds = [ngram.ngram for ngram in ngrams
+                     if 'dbpedia' in ngram.source or (redirects and 'wiki_redirect' in ngram.source)]
+            # categories two levels up, shared parents are looked up once
+            for resource, parent_resource, rel_type in wiki.crawl(seeds, expand, 2):
+                graph.add_edge(resource, parent_resource, type=rel_type)
 
             json_graph.dump(graph, open(graph_object, 'w'))
         else:
@@ -160,87 +172,58 @@ class Article(models.Model):
     @property
     def wikilinks_graph(self):
         """
-        Generate a wikilinks graph using networkx
+        Generate a wikilinks graph of the article n-grams using networkx,
+        derived from the collection-wide links of every n-gram
         :rtype: Graph
         """
-        import tempfile
-        from networkx.readwrite import json_graph
-        import networkx as nx
-        import re
-        import requests
+        if not hasattr(self, '_wikilinks_graph'):
+            ngrams = self.articlecollocation_set.values_list('ngram', flat=True)
+            self._wikilinks_graph = WikiLinks.graph(ngrams)
+        return self._wikilinks_graph
 
-        tmpdir = tempfile.gettempdir()
-        graph_object = tmpdir + '/' + str(self.id) + '.wikilinks.json'
-
-        def _get_links(ngram):
-            ngram_links = json.loads(requests.get(template_query.format(ngram)).text)
-            try:
-                ngram_links = ngram_links['query']['pages'].values()[0]['links']
-            except KeyError:
-                return []
-            ngram_links = [re.sub(r' \(.+\)', '', link['title'].lower()) for link in ngram_links]
-            ngram_links = set([ngram for ngram in ngram_links if len(ngram.split()) > 1])
-            return ngram_links
-
-        if not os.path.exists(graph_object):
-            graph = nx.Graph()
-            links_dict = {}
-            template_query = u'http://en.wikipedia.org/w/api.php?action=query&titles={0}&prop=links&plnamespace=0&pllimit=500&format=json'
-            article_ngrams = list(self.articlecollocation_set.values_list('ngram', flat=True))
-            for i, ngram1 in enumerate(article_ngrams):
-                if ngram1 in links_dict:
-                    ngram1_links = links_dict[ngram1]
-                else:
-                    ngram1_links = _get_links(ngram1)
-                    links_dict[ngram1] = ngram1_links
-                for j in range(i+1, len(article_ngrams)):
-                    ngram2 = article_ngrams[j]
-                    if ngram2 in links_dict:
-                        ngram2_links = links_dict[ngram2]
-                    else:
-                        ngram2_links = _get_links(ngram2)
-                        links_dict[ngram2] = ngram2_links
-                    if ngram1 in ngram2_links or ngram2 in ngram1_links:
-                        graph.add_edge(ngram1, ngram2)
-            json_graph.dump(graph, open(graph_object, 'w'))
-            return graph
+    def _collocation_index(self, lemmas):
+        """
+        :returns: n-gram index to extract collocations from, None if article is not indexed
+        """
+        if not self.index:
+            return None
+        if lemmas:
+            return self.index
+        return self.index_nonstemmed
 
-        else:
-            graph = json_graph.load(open(graph_object))
-            return graph
+    def _collocation_counts(self, lemmas):
+        """
+        Extract collocations of the article with their counts
+        :rtype: dict
+        """
+        return _index_collocation_counts(self._collocation_index(lemmas), lemmas)
 
     def _create_collocations(self, lemmas):
         """Create collocation for the article"""
-        from axel.libs import nlp
-        if self.index:
-            if lemmas:
-                index = json.loads(self.index)
-            else:
-                index = self.index_nonstemmed
-            collocs = nlp.collocations(index)
-
-            # Create other collocations
-            for name, score in collocs.iteritems():
-                if score > 0:
-                    if not lemmas:
-                        name = nlp.Stemmer.stem_wordnet(name)
-                    colloc, created = TestCollocations.objects.get_or_create(ngram=name,
-                                                            article=self, defaults={'count': score})
-                    if not created:
-                        colloc.count += score
-                        colloc.save()
-        else:
-            print 'No n-gram index found'
+        for name, score in self._collocation_counts(lemmas).iteritems():
+            colloc, created = TestCollocations.objects.get_or_create(ngram=name, article=self,
+                                                                     defaults={'count': score})
+            if not created:
+                colloc.count += score
+                colloc.save()
 
     @classmethod
-    def create_collocations(cls, cluster_id, method='global_collocations', lemmas=True):
+    def create_collocations(cls, cluster_id, method='global_collocations', lemmas=True, bulk=False,
+                            chunk_size=100, processes=None):
         """
         Populates collocation for the specified article collection
         :param cluster_id: cluster id to specify article collection
+        :param bulk: compute all collocations in memory and write them with bulk inserts
+        :param chunk_size: number of articles written per transaction in bulk mode
+        :param processes: number of worker processes to extract collocations with, implies bulk
         """
         print 'Deleting existing population'
         TestCollocations.objects.all().delete()
 
+        if bulk or processes:
+            cls._bulk_create_collocations(cluster_id, method, lemmas, chunk_size, processes)
+            return
+
         print 'Initial population...'
         for article in cls.objects.filter(cluster_id=cluster_id):
             # create all found collocations inside single article
@@ -255,8 +238,8 @@ class Article(models.Model):
             print 'Global re-population...'
             # add existing if do not exist yet
             for article in cls.objects.filter(cluster_id=cluster_id):
-                index = json.loads(article.index)
-                for colloc in all_collocs.intersection(index.keys()):
+                index = article.index
+                for colloc in [colloc for colloc in all_collocs if colloc in index]:
                     # get or create because we are not filtrating old ones
                     TestCollocations.objects.get_or_create(ngram=colloc,
                                                            article=article,
@@ -269,7 +252,7 @@ class Article(models.Model):
                                 key=lambda x: (x[1], x[0]))
                 if not ngrams:
                     continue
-                index = json.loads(article.index)
+                index = article.index
                 new_ngrams = nlp._update_ngram_counts([c.split() for c in zip(*ngrams)[0]], index)
                 # sort by count, then alphabetically
                 new_ngrams = sorted(new_ngrams.items(), key=lambda x: (x[1], x[0]))
@@ -285,8 +268,8 @@ class Article(models.Model):
             print 'Global re-population...'
             # add existing if do not exist yet
             for article in cls.objects.filter(cluster_id=cluster_id):
-                index = json.loads(article.index)
-                for colloc in all_collocs.intersection(index.keys()):
+                index = article.index
+                for colloc in [colloc for colloc in all_collocs if colloc in index]:
                     # get or create because we are not filtrating old ones
                     TestCollocations.objects.get_or_create(ngram=colloc,
                                                            article=article,
@@ -301,7 +284,7 @@ class Article(models.Model):
                                 key=lambda x: (x[1], x[0]))
                 if not ngrams:
                     continue
-                index = json.loads(article.index)
+                index = article.index
                 new_ngrams = nlp._generate_possible_ngrams([tuple(c.split()) for c in zip(*ngrams)[0]],
                                                            index)
                 new_ngrams = _update_ngram_counts(new_ngrams, index)
@@ -316,6 +299,44 @@ class Article(models.Model):
 
         locals()[method]()
 
+    @classmethod
+    def _bulk_create_collocations(cls, cluster_id, method, lemmas, chunk_size, processes=None):
+        """
+        Bulk mode of create_collocations, produces the same TestCollocations contents,
+        but computes final counts in memory instead of updating rows after each step.
+        Extraction is distributed over a pool of worker processes if processes is set.
+        """
+        print 'Initial population...'
+        articles = cls.objects.filter(cluster_id=cluster_id).only('index', 'index_nonstemmed')
+        tasks = ((article.id, article._collocation_index(lemmas), lemmas) for article in articles)
+        article_collocs = dict(pool_map(_collocation_counts_task, tasks, processes, chunk_size))
+        all_collocs = set()
+        for collocs in article_collocs.itervalues():
+            all_collocs.update(collocs)
+
+        if method != 'local_collocations':
+            print 'Global re-population...'
+            rejoin = method == 'global_collocations_rejoin'
+            articles = cls.objects.filter(cluster_id=cluster_id).only('index')
+            tasks = ((article.id, article_collocs[article.id], article.index, rejoin)
+                     for article in articles if article.index)
+            try:
+                article_collocs.update(print_progress(
+                    pool_map(_global_collocation_counts_task, tasks, processes, chunk_size,
+                             _set_worker_collocs, (all_collocs,)), total=len(article_collocs)))
+            finally:
+                # the serial path initializes the current process
+                _set_worker_collocs(set())
+
+        print 'Writing collocations...'
+        article_collocs = article_collocs.items()
+        for i in range(0, len(article_collocs), chunk_size):
+            with transaction.atomic():
+                TestCollocations.objects.bulk_create(
+                    [TestCollocations(ngram=ngram, count=count, article_id=article_id)
+                     for article_id, collocs in article_collocs[i:i + chunk_size]
+                     for ngram, count in collocs.iteritems()], batch_size=500)
+
     @classmethod
     def populate_wiki_index(cls, cluster_id):
         import networkx as nx
@@ -337,6 +358,81 @@ class Article(models.Model):
         return self.CollocationModel.objects.filter(article=self)
 
 
+def _index_collocation_counts(index, lemmas):
+    """
+    Extract collocations with their counts from the article n-gram index
+    :param lemmas: whether the index is lemmatized, collocations are lemmatized otherwise
+    :rtype: dict
+    """
+    counts = defaultdict(int)
+    if index:
+        for name, score in nlp.collocations(index).iteritems():
+            if score > 0:
+                if not lemmas:
+                    name = nlp.Stemmer.stem_wordnet(name)
+                counts[name] += score
+    else:
+        print 'No n-gram index found'
+    return counts
+
+
+def _global_collocation_counts(collocs, all_collocs, index, rejoin=False):
+    """
+    Add collection-wide collocations present in the article n-gram index and recalculate counts,
+    in-memory version of the global re-population in Article.create_collocations
+    :param collocs: article collocation counts
+    :type collocs: dict
+    :type all_collocs: set
+    :param rejoin: whether to generate longer n-grams from the joined collocations
+    :rtype: dict
+    """
+    collocs = dict(collocs)
+    for colloc in all_collocs:
+        if colloc not in collocs and colloc in index:
+            collocs[colloc] = index[colloc]
+    if not collocs:
+        return collocs
+    if rejoin:
+        ngrams = nlp._generate_possible_ngrams([tuple(c.split()) for c in collocs], index)
+    else:
+        ngrams = [c.split() for c in collocs]
+    return dict([(ngram, count) for ngram, count in nlp._update_ngram_counts(ngrams, index).iteritems()
+                 if count > 0])
+
+
+def _collocation_counts_task(args):
+    """Pool worker, extracts collocations of a single article"""
+    article_id, index, lemmas = args
+    return article_id, _index_collocation_counts(index, lemmas)
+
+
+# collection-wide collocations, shared with pool workers by _set_worker_collocs
+_worker_collocs = set()
+
+
+def _set_worker_collocs(all_collocs):
+    """Pool initializer for _global_collocation_counts_task"""
+    global _worker_collocs
+    _worker_collocs = all_collocs
+
+
+def _global_collocation_counts_task(args):
+    """Pool worker, re-populates collocations of a single article"""
+    article_id, collocs, index, rejoin = args
+    return article_id, _global_collocation_counts(collocs, _worker_collocs, index, rejoin)
+
+
+def warm_cache_task(args):
+    """
+    Pool worker, computes cached properties of the article collocations
+    and writes them in one transaction, see ArticleCollocation.warm_cache
+    """
+    cluster_id, article_id, fields = args
+    with db_cache.deferred():
+        return article_id, CLUSTERS_DICT[cluster_id].warm_cache(Article.objects.get(id=article_id),
+                                                                fields)
+
+
 class TestCollocations(models.Model):
     """
     Model contains collocation for each article and their respective counts,
@@ -348,6 +444,138 @@ class TestCollocations(models.Model):
     article = models.ForeignKey(Article)
 
 
+class WikiLinks(models.Model):
+    """
+    Collection-wide adjacency table of n-grams: lower cased multi-word titles of the Wikipedia
+    pages linked from the n-gram page, without disambiguation suffixes.
+    Links of every n-gram are fetched once, subgraphs of any n-gram set are derived from them.
+    """
+    ngram = models.CharField(max_length=255, unique=True)
+    links = JSONField()
+
+    # number of n-grams fetched per query
+    CHUNK_SIZE = 500
+
+    @staticmethod
+    def fetch_links(ngram):
+        """
+        :type ngram: unicode
+        :rtype: list
+        """
+        import re
+        ngram_links = [re.sub(r' \(.+\)', '', link.lower()) for link in wiki.wiki_links(ngram)]
+        return sorted(set([link for link in ngram_links if len(link.split()) > 1]))
+
+    @classmethod
+    def get_links(cls, ngrams, workers=None):
+        """
+        Links of the n-grams, missing ones are fetched concurrently and stored
+        :type ngrams: set
+        :param workers: number of concurrent lookups, settings.CRAWLER_WORKERS by default
+        :returns: dict from the n-gram to the set of its links
+        :rtype: dict
+        """
+        from multiprocessing.pool import ThreadPool
+        ngrams = list(ngrams)
+        links = {}
+        for i in range(0, len(ngrams), cls.CHUNK_SIZE):
+            for ngram_links in cls.objects.filter(ngram__in=ngrams[i:i + cls.CHUNK_SIZE]):
+                links[ngram_links.ngram] = set(ngram_links.links)
+        missing = [ngram for ngram in ngrams if ngram not in links]
+        if missing:
+            pool = ThreadPool(workers or settings.CRAWLER_WORKERS)
+            try:
+                fetched = pool.map(cls.fetch_links, missing)
+            finally:
+                pool.terminate()
+            cls.objects.bulk_create([cls(ngram=ngram, links=ngram_links)
+                                     for ngram, ngram_links in zip(missing, fetched)],
+                                    batch_size=cls.CHUNK_SIZE)
+            for ngram, ngram_links in zip(missing, fetched):
+                links[ngram] = set(ngram_links)
+        return links
+
+    @classmethod
+    def graph(cls, ngrams):
+        """
+        Graph of the n-grams with an edge if any of two n-grams links to the other one
+        :rtype: nx.Graph
+        """
+        import networkx as nx
+        ngrams = set(ngrams)
+        graph = nx.Graph()
+        for ngram, ngram_links in cls.get_links(ngrams).iteritems():
+            for linked_ngram in ngram_links.intersection(ngrams):
+                if linked_ngram != ngram:
+                    graph.add_edge(ngram, linked_ngram)
+        return graph
+
+
+class IndexedArticle(models.Model):
+    """Article added to the concept search index, see axel.articles.utils.search"""
+    article = models.OneToOneField(Article, primary_key=True, related_name='indexed')
+    # sum of the concept counts of the article
+    length = models.IntegerField()
+
+
+class ConceptPostings(models.Model):
+    """
+    Inverted concept index entry: articles of the cluster containing the concept,
+    stored as (article id, concept count, article length) triples sorted by article id
+    """
+    cluster_id = models.CharField(max_length=255)
+    ngram = models.CharField(max_length=255)
+    # document frequency, number of the triples
+    df = models.IntegerField()
+    postings = OffsetArrayField()
+
+    class Meta:
+        """Meta info"""
+        unique_together = ('cluster_id', 'ngram')
+
+
+class TaggedText(models.Model):
+    """
+    Part-of-speech tagged sentences of the article text,
+    stored as sentence offsets, token offsets and tags (see TaggedSentences.rows).
+    Regenerated on access when the article text changes.
+    """
+    article = models.OneToOneField(Article, related_name='tagged_text')
+    text_hash = models.CharField(max_length=32)
+    sentences = JSONField()
+
+    @staticmethod
+    def hash_text(text):
+        """
+        :type text: unicode
+        :rtype: str
+        """
+        return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def get_tagged_sentences(cls, article):
+        """
+        Load tagged sentences of the article, tag and store them if missing or outdated
+        :type article: Article
+        :rtype: TaggedSentences
+        """
+        if article.pk is None:
+            return scores.TaggedSentences.from_text(article.text, article.sentence_ends)
+        text_hash = cls.hash_text(article.text)
+        try:
+            tagged_text = cls.objects.get(article=article)
+        except cls.DoesNotExist:
+            tagged_text = cls(article=article)
+        else:
+            if tagged_text.text_hash == text_hash:
+                return scores.TaggedSentences.from_rows(article.text, tagged_text.sentences)
+        tagged = scores.TaggedSentences.from_text(article.text, article.sentence_ends)
+        tagged_text.text_hash = text_hash
+        tagged_text.sentences = tagged.rows()
+        tagged_text.save()
+        return tagged
+
+
 class ArticleCollocationsManager(models.Manager):
 
     def get_query_set(self):
@@ -371,6 +599,8 @@ class ArticleCollocation(models.Model):
 
     # Populated by subclasses
     judged_data = None
+    # properties cached in extra_fields by db_cache
+    CACHED_PROPERTIES = ('context', 'pos_tag', 'pos_tag_prev', 'pos_tag_after')
 
     class Meta:
         """Meta info"""
@@ -418,9 +648,9 @@ class ArticleCollocation(models.Model):
         :returns: context if found, ngram itself otherwise
         """
         # prevent contexts from bigger ngrams
-        bigger_ngrams = self.article.articlecollocation_set.filter(ngram__contains=self.ngram)\
-            .exclude(ngram=self.ngram).values_list('ngram', flat=True)
-        context = next(get_contexts(self.article.text, self.ngram, bigger_ngrams), self.ngram)
+        bigger_ngrams = self.article.bigger_ngrams(self.ngram)
+        context = next(get_contexts(self.article.text, self.ngram, bigger_ngrams,
+                                    self.article.sentence_ends), self.ngram)
         return context
 
     def all_contexts(self, func=get_contexts):
@@ -431,9 +661,8 @@ class ArticleCollocation(models.Model):
         """
         contexts = []
         text = self.article.text
-        bigger_ngrams = self.article.articlecollocation_set.filter(ngram__contains=self.ngram)\
-            .exclude(ngram=self.ngram).values_list('ngram', flat=True)
-        for context in func(text, self.ngram, bigger_ngrams):
+        bigger_ngrams = self.article.bigger_ngrams(self.ngram)
+        for context in func(text, self.ngram, bigger_ngrams, self.article.sentence_ends):
             contexts.append(context)
         return contexts
 
@@ -445,10 +674,20 @@ class ArticleCollocation(models.Model):
         """
         contexts = []
         text = self.article.text
-        for context in func(text, self.ngram, []):
+        for context in func(text, self.ngram, [], self.article.sentence_ends):
             contexts.append(context)
         return contexts
 
+    @property
+    def _pos_contexts(self):
+        """
+        Contexts with matched n-grams shared by all POS properties
+        :rtype: list
+        """
+        if not hasattr(self, '_pos_contexts_cache'):
+            self._pos_contexts_cache = self.all_contexts_pos(func=get_contexts_ngrams)
+        return self._pos_contexts_cache
+
     @property
     @db_cache('extra_fields')
     def pos_tag(self):
@@ -457,7 +696,7 @@ class ArticleCollocation(models.Model):
         :return: Part-of-Speech tag
         :rtype: unicode
         """
-        return scores.pos_tag(self.ngram, self.all_contexts_pos(func=get_contexts_ngrams))
+        return scores.pos_tag(self.ngram, self._pos_contexts, self.article.tagged_sentences)
 
     @property
     def max_pos_tag(self):
@@ -475,7 +714,8 @@ class ArticleCollocation(models.Model):
         :return: list of Part-of-Speech tags with scores
         :rtype: list
         """
-        return scores.pos_tag_pos(self.ngram, self.all_contexts_pos(func=get_contexts_ngrams))
+        return scores.pos_tag_pos(self.ngram, self._pos_contexts,
+                                  tagged=self.article.tagged_sentences)
 
     @property
     @db_cache('extra_fields')
@@ -485,7 +725,76 @@ class ArticleCollocation(models.Model):
         :return: list of Part-of-Speech tags with scores
         :rtype: list
         """
-        return scores.pos_tag_pos(self.ngram, self.all_contexts_pos(func=get_contexts_ngrams), tag_pos=1)
+        return scores.pos_tag_pos(self.ngram, self._pos_contexts, tag_pos=1,
+                                  tagged=self.article.tagged_sentences)
+
+    @classmethod
+    def warm_cache(cls, article, fields=CACHED_PROPERTIES):
+        """
+        Compute missing cached properties of all article collocations,
+        sharing text, sentence offsets, matched n-grams and POS tags of the article
+        :type article: Article
+        :param fields: names of the cached properties to compute
+        :returns: number of collocations with computed properties
+        :rtype: int
+        """
+        ngrams = list(cls.objects.filter(article=article))
+        missing = [ngram for ngram in ngrams
+                   if any(field not in ngram.extra_fields for field in fields)]
+        if not missing:
+            return 0
+        ContextEngine.for_text(article.text, article.sentence_ends)\
+            .add([ngram.ngram for ngram in ngrams])
+        for ngram in missing:
+            ngram.article = article
+            for field in fields:
+                getattr(ngram, field)
+        return len(missing)
+
+    @classmethod
+    def update_counts(cls, ngrams=None, create=True):
+        """
+        Recalculate collection counts of the n-grams and total counts of their collocations
+        with set-based queries, bulk counterpart of update_global_collocations.
+        :param ngrams: changed n-grams, all collection collocations are recalculated by default
+        :param create: whether to create missing collection collocations,
+        total counts of n-grams without them are left as is otherwise
+        """
+        model = cls.COLLECTION_MODEL
+        if ngrams is None:
+            chunks = [None]
+            new_ngrams = set(cls.objects.values_list('ngram', flat=True)) \
+                .difference(model.objects.values_list('ngram', flat=True))
+        else:
+            ngrams = list(set(ngrams))
+            chunks = [ngrams[i:i + COUNTS_CHUNK_SIZE]
+                      for i in range(0, len(ngrams), COUNTS_CHUNK_SIZE)]
+            new_ngrams = set(ngrams)
+            for chunk in chunks:
+                new_ngrams.difference_update(model.objects.filter(ngram__in=chunk)
+                                             .values_list('ngram', flat=True))
+        new_ngrams = dict.fromkeys(new_ngrams, 0) if create else {}
+
+        qn = connection.ops.quote_name
+        tables = {'collocation': qn(model._meta.db_table),
+                  'article_collocation': qn(cls._meta.db_table),
+                  'article': qn(Article._meta.db_table)}
+        # counts are set below
+        bulk_create_collocations(model, new_ngrams, COUNTS_CHUNK_SIZE)
+        with transaction.atomic():
+            cursor = connection.cursor()
+            for chunk in chunks:
+                if chunk is None:
+                    where = ''
+                    params = [cls.CLUSTER_ID]
+                else:
+                    where = 'ngram IN ({0})'.format(', '.join(['%s'] * len(chunk)))
+                    params = [cls.CLUSTER_ID] + chunk
+                cursor.execute(UPDATE_COUNT_SQL.format(where=' WHERE ' + where if where else '',
+                                                       **tables), params)
+                cursor.execute(UPDATE_TOTAL_COUNT_SQL.format(where=' AND ' + where if where else '',
+                                                             **tables), params)
+        concepts_changed(model.CLUSTER_ID)
 
     @classmethod
     def scores(cls):
@@ -552,7 +861,43 @@ def clean_collocations(sender, instance, **kwargs):
     """
     colloc = instance.article.CollocationModel.COLLECTION_MODEL.objects.get(ngram=instance.ngram)
     colloc.count -= instance.count
-    colloc.save()
+    # source is written concurrently by the source matcher
+    colloc.save(update_fields=['count'])
+
+
+# sentence boundary receivers are connected without sender, .only()/.defer() instances
+# are sent by generated subclasses of Article
+@receiver(post_init)
+def init_sentence_ends(sender, instance, **kwargs):
+    """
+    Remember the text stored sentence boundaries belong to
+    :type instance: Article
+    """
+    if issubclass(sender, Article) and 'text' in instance.__dict__:
+        instance._sentence_ends_text = instance.text
+
+
+@receiver(pre_save)
+def update_sentence_ends(sender, instance, **kwargs):
+    """
+    Index sentence boundaries of the text for context lookups,
+    a deferred text is not changed and is not loaded
+    :type instance: Article
+    """
+    if issubclass(sender, Article) and 'text' in instance.__dict__:
+        instance._sentence_ends = instance.sentence_ends
+
+
+@receiver(post_save)
+def save_sentence_ends(sender, instance, update_fields=None, **kwargs):
+    """
+    Store sentence boundaries skipped by a partial save of the text,
+    e.g. of an instance with deferred boundaries
+    :type instance: Article
+    """
+    if issubclass(sender, Article) and update_fields is not None and \
+            'text' in update_fields and '_sentence_ends' not in update_fields:
+        Article.objects.filter(pk=instance.pk).update(_sentence_ends=instance.sentence_ends)
 
 
 @receiver(pre_delete, sender=Article)
@@ -565,6 +910,41 @@ def clean_pdf(sender, instance, **kwargs):
         os.unlink(instance.pdf.path)
 
 
+# number of n-grams updated by a single statement in ArticleCollocation.update_counts
+COUNTS_CHUNK_SIZE = 500
+
+UPDATE_COUNT_SQL = \
+    'UPDATE {collocation} SET count = (' \
+    'SELECT COALESCE(SUM(ac.count), 0) FROM {article_collocation} ac ' \
+    'INNER JOIN {article} a ON ac.article_id = a.id ' \
+    'WHERE ac.ngram = {collocation}.ngram AND a.cluster_id = %s){where}'
+
+UPDATE_TOTAL_COUNT_SQL = \
+    'UPDATE {article_collocation} SET total_count = (' \
+    'SELECT COALESCE(MAX(c.count), {article_collocation}.total_count) FROM {collocation} c ' \
+    'WHERE c.ngram = {article_collocation}.ngram) ' \
+    'WHERE article_id IN (SELECT id FROM {article} WHERE cluster_id = %s){where}'
+
+# stack of n-grams saved while update_global_collocations is suspended, by model
+_suspended_counts = []
+
+
+@contextmanager
+def suspended_collocation_counts():
+    """
+    Skip update_global_collocations for saved article collocations,
+    counts of all saved n-grams are updated with set-based queries on exit instead
+    """
+    saved = defaultdict(set)
+    _suspended_counts.append(saved)
+    try:
+        yield
+    finally:
+        _suspended_counts.pop()
+    for model, ngrams in saved.iteritems():
+        model.update_counts(ngrams)
+
+
 def update_global_collocations(sender, instance, created, **kwargs):
     """
     Increment collocation count on create for ArticleCollocation
@@ -572,6 +952,9 @@ def update_global_collocations(sender, instance, created, **kwargs):
     """
     if kwargs.get('raw'):
         return
+    if _suspended_counts:
+        _suspended_counts[-1][sender].add(instance.ngram)
+        return
     colloc, created_local = instance.COLLECTION_MODEL.objects.get_or_create(
         ngram=instance.ngram, defaults={'count': instance.count})
     if not created_local:
@@ -580,7 +963,8 @@ def update_global_collocations(sender, instance, created, **kwargs):
         else:
             # Recalculate collection count otherwise
             colloc.count = sender.objects.filter(ngram=instance.ngram).aggregate(count=Sum('count'))['count']
-        colloc.save()
+        # source is written concurrently by the source matcher
+        colloc.save(update_fields=['count'])
     # update total count locally
     instance.total_count = colloc.count
     instance.save_base(raw=True)
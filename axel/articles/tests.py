@@ -1,9 +1,20 @@
 """Unit-tests for articles app"""
 import os
+import shutil
+import tempfile
+import threading
 from django.test import TestCase
 from django.conf import settings
 from django.core.files import File
-from axel.articles.models import Article
+from axel.articles.models import Article, CSArticleCollocations, TaggedText, TestCollocations, \
+    WikiLinks, suspended_collocation_counts
+from axel.articles.utils.concepts_index import ConceptAutocomplete, get_autocomplete
+from axel.articles.utils.db import db_cache, NgramIndexField
+from axel.articles.utils.search import ConceptIndex
+from axel.libs import nlp
+from axel.libs.cache import SQLiteCache
+from axel.libs.external_match import source_matcher
+from axel.libs.ngram_index import NgramIndex
 from axel.stats.models import Collocations
 
 
@@ -28,3 +39,232 @@ class CollocationsTest(TestCase):
         collocs = Collocations.objects.filter(count__gt=0).exists()
         self.assertFalse(collocs)
 
+
+
+class NgramIndexFieldTest(TestCase):
+    """Tests n-gram index field conversions"""
+
+    def test_to_python(self):
+        """Test dict assignment and legacy JSON values, as text and as bytes"""
+        field = NgramIndexField()
+        for value in ({u'latent semantic': 2}, u'{"latent semantic": 2}',
+                      '{"latent semantic": 2}', buffer('{"latent semantic": 2}')):
+            index = field.to_python(value)
+            self.assertIsInstance(index, NgramIndex)
+            self.assertEqual(index.items(), [(u'latent semantic', 2)])
+        self.assertIsNone(field.to_python(''))
+        self.assertIsNone(field.to_python(None))
+
+    def test_value_to_string(self):
+        """Test serialized value is loaded back"""
+        article = Article(index={u'latent semantic': 2, u'semantic indexing': 1})
+        field = Article._meta.get_field('index')
+        index = field.to_python(field.value_to_string(article).decode('ascii'))
+        self.assertEqual(dict(index.iteritems()), {u'latent semantic': 2, u'semantic indexing': 1})
+
+
+class BulkCollocationsTest(TestCase):
+    """Tests bulk and parallel collocation population give the same results"""
+
+    TEXTS = (u'probabilistic latent semantic indexing is a model. ' * 4 +
+             u'latent semantic analysis works. ' * 3 + u'information retrieval system helps. ' * 3,
+             u'latent semantic indexing improves information retrieval. ' * 3 +
+             u'query expansion method works. ' * 3,
+             u'information retrieval system and query expansion. ' * 3 +
+             u'probabilistic latent semantic models. ' * 3)
+
+    def setUp(self):
+        for text in self.TEXTS:
+            Article.objects.create(venue_id=3, year=1999, cluster_id='CS_COLLOCS', text=text,
+                                   stemmed_text=text, index=nlp.build_ngram_index(text))
+
+    def _populate(self, method, **kwargs):
+        Article.create_collocations('CS_COLLOCS', method=method, **kwargs)
+        return set(TestCollocations.objects.values_list('article_id', 'ngram', 'count'))
+
+    def test_bulk(self):
+        """Test bulk mode produces the same rows for every method"""
+        for method in ('global_collocations', 'global_collocations_rejoin', 'local_collocations'):
+            rows = self._populate(method)
+            self.assertTrue(rows)
+            self.assertEqual(self._populate(method, bulk=True), rows)
+
+    def test_processes(self):
+        """Test extraction in worker processes produces the same rows as the serial bulk mode"""
+        rows = self._populate('global_collocations', bulk=True)
+        self.assertEqual(self._populate('global_collocations', processes=2), rows)
+
+
+class CollocationCountsTest(TestCase):
+    """Tests set-based maintenance of aggregated counts"""
+
+    def test_suspended_counts(self):
+        """Test counts are the same as maintained by the post_save signal"""
+        Collocations.objects.bulk_create([Collocations(ngram=u'latent semantic', count=1)])
+        articles = [Article.objects.create(venue_id=3, year=1999, cluster_id='CS_COLLOCS')
+                    for _ in range(2)]
+        with suspended_collocation_counts():
+            for article, count in zip(articles, (2, 3)):
+                CSArticleCollocations.objects.create(ngram=u'latent semantic', count=count,
+                                                     total_count=0, article=article)
+            self.assertEqual(Collocations.objects.get(ngram=u'latent semantic').count, 1)
+        self.assertEqual(Collocations.objects.get(ngram=u'latent semantic').count, 5)
+        self.assertEqual(set(CSArticleCollocations.objects.values_list('total_count', flat=True)),
+                         {5})
+
+
+class DbCacheTest(TestCase):
+    """Tests deferred writes of cached properties"""
+
+    def test_deferred(self):
+        """Test values are written once on exit from the deferred block"""
+        Collocations.objects.bulk_create([Collocations(ngram=u'latent semantic', count=2)])
+        colloc = Collocations.objects.get(ngram=u'latent semantic')
+        with db_cache.deferred() as pending:
+            self.assertEqual(colloc.df_score, 0)
+            self.assertEqual(colloc.source, [])
+            self.assertEqual(pending, [colloc])
+            self.assertIsNone(Collocations.objects.get(id=colloc.id)._df_score)
+        colloc = Collocations.objects.get(id=colloc.id)
+        self.assertEqual(colloc._df_score, 0)
+        self.assertEqual(colloc.extra_fields, {'source': []})
+
+    def test_deferred_threads(self):
+        """Test deferred blocks are not shared with other threads"""
+        worker_blocks = []
+        with db_cache.deferred():
+            worker = threading.Thread(target=lambda: worker_blocks.append(len(db_cache._pending())))
+            worker.start()
+            worker.join()
+            self.assertEqual(len(db_cache._pending()), 1)
+        self.assertEqual(worker_blocks, [0])
+
+
+class SentenceEndsTest(TestCase):
+    """Tests stored sentence boundaries"""
+
+    def test_sentence_ends(self):
+        """Test boundaries are stored on save and follow text changes"""
+        article = Article.objects.create(venue_id=3, year=1999, cluster_id='CS_COLLOCS',
+                                         text=u'We index text; it works. Does it?')
+        article = Article.objects.get(id=article.id)
+        self.assertEqual(list(article._sentence_ends), [14, 24, 33])
+        self.assertEqual(list(article.sentence_ends), [14, 24, 33])
+        article.text = u'One sentence. Two'
+        self.assertEqual(list(article.sentence_ends), [13])
+
+    def test_deferred_save(self):
+        """Test boundaries are stored when the text is saved from a deferred instance"""
+        article = Article.objects.create(venue_id=3, year=1999, cluster_id='CS_COLLOCS',
+                                         text=u'We index text; it works. Does it?')
+        deferred = Article.objects.only('text').get(id=article.id)
+        deferred.text = u'One sentence. Two'
+        deferred.save()
+        self.assertEqual(list(Article.objects.get(id=article.id)._sentence_ends), [13])
+
+
+class TaggedTextTest(TestCase):
+    """Tests stored POS tagged sentences"""
+
+    def test_invalidation(self):
+        """Test tags are stored once and regenerated after text changes"""
+        article = Article.objects.create(venue_id=3, year=1999, cluster_id='CS_COLLOCS',
+                                         text=u'We index text; latent semantic indexing works.')
+        tagged = article.tagged_sentences
+        tagged_text = TaggedText.objects.get(article=article)
+        self.assertEqual(tagged_text.text_hash, TaggedText.hash_text(article.text))
+        restored = Article.objects.get(id=article.id).tagged_sentences
+        self.assertEqual(list(restored.sentences()), list(tagged.sentences()))
+
+        article.text = u'Probabilistic models work.'
+        self.assertEqual([sentence for sentence, _ in article.tagged_sentences.sentences()],
+                         [u'Probabilistic models work.'])
+        self.assertEqual(TaggedText.objects.get(article=article).text_hash,
+                         TaggedText.hash_text(article.text))
+
+
+class WikiLinksTest(TestCase):
+    """Tests subgraphs derived from the collection-wide links"""
+
+    def test_graph(self):
+        """Test n-grams are connected if any of them links to the other one"""
+        WikiLinks.objects.bulk_create([
+            WikiLinks(ngram=u'latent semantic analysis',
+                      links=[u'latent semantic analysis', u'singular value decomposition']),
+            WikiLinks(ngram=u'singular value decomposition', links=[u'linear algebra']),
+            WikiLinks(ngram=u'probabilistic model', links=[u'latent semantic analysis'])])
+        graph = WikiLinks.graph([u'latent semantic analysis', u'singular value decomposition',
+                                 u'probabilistic model'])
+        self.assertEqual(set(map(frozenset, graph.edges())),
+                         {frozenset([u'latent semantic analysis', u'singular value decomposition']),
+                          frozenset([u'latent semantic analysis', u'probabilistic model'])})
+
+
+class ConceptIndexTest(TestCase):
+    """Tests ranked conceptual search"""
+
+    def test_search(self):
+        """Test articles are ranked by concept counts and new articles are added incrementally"""
+        Collocations.objects.bulk_create([Collocations(ngram=u'latent semantic', count=1),
+                                          Collocations(ngram=u'language model', count=1)])
+        articles = [Article.objects.create(venue_id=3, year=1999, cluster_id='CS_COLLOCS')
+                    for _ in range(4)]
+        with suspended_collocation_counts():
+            for article, ngram, count in ((articles[0], u'latent semantic', 1),
+                                          (articles[0], u'language model', 5),
+                                          (articles[1], u'latent semantic', 4),
+                                          (articles[2], u'language model', 1)):
+                CSArticleCollocations.objects.create(ngram=ngram, count=count, total_count=0,
+                                                     article=article)
+        index = ConceptIndex('CS_COLLOCS')
+        self.assertEqual(index.rebuild(), 3)
+        for ranking in ('bm25', 'tfidf'):
+            self.assertEqual([article_id for article_id, _ in
+                              index.search([u'latent semantic'], ranking=ranking)],
+                             [articles[1].id, articles[0].id])
+        with suspended_collocation_counts():
+            CSArticleCollocations.objects.create(ngram=u'latent semantic', count=9, total_count=0,
+                                                 article=articles[3])
+        self.assertEqual(index.add_articles(), 1)
+        self.assertEqual(index.search([u'latent semantic'], k=1)[0][0], articles[3].id)
+
+
+class ConceptAutocompleteTest(TestCase):
+    """Tests in-memory concept autocomplete"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.matcher_state = source_matcher.threads, source_matcher.cache
+
+    def tearDown(self):
+        source_matcher.threads, source_matcher.cache = self.matcher_state
+        shutil.rmtree(self.tmpdir)
+
+    def test_search(self):
+        """Test concepts with a word starting with the query are returned by count"""
+        autocomplete = ConceptAutocomplete([(u'latent semantic analysis', 3),
+                                            (u'semantic web', 7),
+                                            (u'Semantics', 5),
+                                            (u'language model', 9)], k=2)
+        self.assertEqual(autocomplete.search(u'se'), [(u'semantic web', 7), (u'Semantics', 5)])
+        self.assertEqual(autocomplete.search(u'semantic  a'), [(u'latent semantic analysis', 3)])
+        self.assertEqual(autocomplete.search(u'antic'), [])
+        self.assertEqual(autocomplete.search(u' '), [])
+
+    def test_refresh(self):
+        """Test the index is rebuilt after collocations change"""
+        cache_path = os.path.join(self.tmpdir, 'source_match.sqlite')
+        # created collocations are matched synchronously with results from the seeded cache
+        source_matcher.threads = 0
+        source_matcher.cache = SQLiteCache(cache_path)
+        source_matcher.cache.set(u'semantic web', [])
+        source_matcher.cache.set(u'web service', [])
+        with self.settings(CONCEPT_AUTOCOMPLETE_REFRESH=0, SOURCE_MATCH_THREADS=0,
+                           SOURCE_MATCH_CACHE=cache_path,
+                           CONCEPT_AUTOCOMPLETE_STAMP=os.path.join(self.tmpdir, '{0}.stamp')):
+            Collocations.objects.create(ngram=u'semantic web', count=2)
+            self.assertEqual(get_autocomplete(Collocations).search(u'web'),
+                             [(u'semantic web', 2)])
+            Collocations.objects.create(ngram=u'web service', count=4)
+            self.assertEqual(get_autocomplete(Collocations).search(u'web'),
+                             [(u'web service', 4), (u'semantic web', 2)])
@@ -1,8 +1,16 @@
 """
 Building and maintaining index of words-concepts
-This file is imported from settings
+and the in-memory concept autocomplete of every process
 """
+from bisect import bisect_left
 from collections import defaultdict
+import heapq
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
 from django.core.cache import cache
 
 import sys
@@ -65,3 +73,139 @@ def update_index(c_id, keywords):
         global_set = cache.get(WORDS_SET)
         global_set.update(extra_words_set)
         cache.set(WORDS_SET, global_set, EXPIRE)
+
+
+WORD_START_RE = re.compile(r'\b\w', re.U)
+# the largest character, every key starting with a prefix sorts below prefix + LAST_CHAR
+LAST_CHAR = u'\uffff'
+
+
+class ConceptAutocomplete(object):
+    """
+    Sorted array of lower cased concept suffixes starting at the words of the concepts,
+    a query matches the concepts with a word starting with it.
+    Concepts are numbered by descending count, so the top concepts of a query
+    are its smallest matching numbers.
+    Results of the short prefixes, which match most of the array, are precomputed.
+    """
+    PRECOMPUTED_PREFIX_LENGTH = 2
+
+    def __init__(self, concepts, k):
+        """
+        :param concepts: (ngram, count) pairs
+        :param k: maximum number of results
+        """
+        self.k = k
+        self.concepts = sorted(concepts, key=lambda concept: -concept[1])
+        suffixes = []
+        self._precomputed = defaultdict(list)
+        for rank, (ngram, _) in enumerate(self.concepts):
+            ngram = ngram.lower()
+            for match in WORD_START_RE.finditer(ngram):
+                suffix = ngram[match.start():]
+                suffixes.append((suffix, rank))
+                # ranks come in ascending order, the first k are the top ones
+                for length in range(1, min(len(suffix), self.PRECOMPUTED_PREFIX_LENGTH) + 1):
+                    top = self._precomputed[suffix[:length]]
+                    if len(top) < k and (not top or top[-1] != rank):
+                        top.append(rank)
+        suffixes.sort()
+        self._keys = [key for key, _ in suffixes]
+        self._ranks = [rank for _, rank in suffixes]
+
+    def __len__(self):
+        return len(self.concepts)
+
+    @staticmethod
+    def normalize(query):
+        """
+        :type query: unicode
+        :rtype: unicode
+        """
+        return u' '.join(query.lower().split())
+
+    def search(self, query):
+        """
+        :type query: unicode
+        :returns: top (ngram, count) pairs by count with a word starting with the query
+        :rtype: list
+        """
+        query = self.normalize(query)
+        if not query:
+            return []
+        if query in self._precomputed:
+            ranks = self._precomputed[query]
+        else:
+            start = bisect_left(self._keys, query)
+            end = bisect_left(self._keys, query + LAST_CHAR, start)
+            ranks = heapq.nsmallest(self.k, set(self._ranks[start:end]))
+        return [self.concepts[rank] for rank in ranks]
+
+
+_autocompletes = {}
+_autocompletes_lock = threading.Lock()
+
+
+def _stamp_path(cluster_id):
+    return settings.CONCEPT_AUTOCOMPLETE_STAMP.format(cluster_id)
+
+
+def _read_stamp(cluster_id):
+    try:
+        return os.path.getmtime(_stamp_path(cluster_id))
+    except OSError:
+        return None
+
+
+def concepts_changed(cluster_id):
+    """
+    Mark autocomplete indexes of the cluster stale in all processes,
+    they are rebuilt on the next query
+    :type cluster_id: str
+    """
+    path = _stamp_path(cluster_id)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'a'):
+        os.utime(path, None)
+
+
+def get_autocomplete(model):
+    """
+    Autocomplete index of the collection collocations, built on first use and rebuilt
+    when they change, at most once per settings.CONCEPT_AUTOCOMPLETE_REFRESH seconds
+    :type model: Collocation
+    :rtype: ConceptAutocomplete
+    """
+    cluster_id = model.CLUSTER_ID
+    autocomplete = _autocompletes.get(cluster_id)
+    if autocomplete is not None and (autocomplete.stamp == _read_stamp(cluster_id) or
+                                     time.time() - autocomplete.built <
+                                     settings.CONCEPT_AUTOCOMPLETE_REFRESH):
+        return autocomplete
+    # other threads keep using the stale index during the rebuild
+    if not _autocompletes_lock.acquire(autocomplete is None):
+        return autocomplete
+    try:
+        if _autocompletes.get(cluster_id) is not autocomplete:
+            # rebuilt by another thread
+            return _autocompletes[cluster_id]
+        # changes during the build are picked up by the next query
+        stamp = _read_stamp(cluster_id)
+        built = time.time()
+        autocomplete = ConceptAutocomplete(model.objects.values_list('ngram', 'count'),
+                                           settings.CONCEPT_AUTOCOMPLETE_RESULTS)
+        autocomplete.stamp = stamp
+        autocomplete.built = built
+        _autocompletes[cluster_id] = autocomplete
+    finally:
+        _autocompletes_lock.release()
+    return autocomplete
+
+
+def load_autocompletes():
+    """Build autocomplete indexes of all clusters, called on worker startup"""
+    from axel.stats.models import STATS_CLUSTERS_DICT
+    for model in STATS_CLUSTERS_DICT.values():
+        get_autocomplete(model)
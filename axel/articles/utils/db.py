@@ -1,17 +1,76 @@
+"""Database related utilities: cached properties and custom fields"""
+from array import array
+from base64 import b64decode, b64encode
+from contextlib import contextmanager
+import json
+import threading
+
+from django.db import models, transaction
+from django.db.models.fields import FieldDoesNotExist
+
+from axel.libs.ngram_index import NgramIndex
+
+
 
 # TODO: make a blog post out of a technique
 class db_cache(object):
     """
     Decorator to cache the expensively computed field in some other field
-    that supports dict-like assignment
+    that supports dict-like assignment.
+    Every computed value is saved right away, unless inside db_cache.deferred()
     """
 
+    # per thread stacks of instance lists with values waiting to be flushed, see deferred
+    _local = threading.local()
+
     def __init__(self, model_field):
         """
         :param model_field: field of the model to store and retrieve field from
         """
         self.model_field = model_field
 
+    @classmethod
+    @contextmanager
+    def deferred(cls, flush=True):
+        """
+        Collect computed values on the instances instead of saving each one.
+        :param flush: write all collected values on exit, one UPDATE per instance,
+        flush_db_cache should be called for every instance otherwise
+        :returns: list of the instances with values not yet written
+        """
+        pending = []
+        cls._pending().append(pending)
+        try:
+            yield pending
+        finally:
+            cls._pending().pop()
+            # values computed before an error are still valid
+            if flush:
+                flush_db_cache_bulk(pending)
+
+    @classmethod
+    def _pending(cls):
+        """
+        Deferred blocks of the current thread, values computed in worker threads
+        are saved right away
+        :rtype: list
+        """
+        if not hasattr(cls._local, 'pending'):
+            cls._local.pending = []
+        return cls._local.pending
+
+    @classmethod
+    def _save(cls, object, field_name):
+        """Save the cached value now or mark it to be flushed"""
+        pending = cls._pending()
+        if not pending:
+            object.save_base(raw=True)
+            return
+        dirty = object.__dict__.setdefault('_db_cache_dirty', set())
+        if not dirty:
+            pending[-1].append(object)
+        dirty.add(field_name)
+
     def __call__(self, f):
         def wrapper(object):
             fields = getattr(object, self.model_field)
@@ -21,7 +80,7 @@ class db_cache(object):
                 value = f(object)
                 fields[f.__name__] = value
                 setattr(object, self.model_field, fields)
-                object.save_base(raw=True)
+                db_cache._save(object, self.model_field)
                 return value
         return wrapper
 
@@ -35,6 +94,135 @@ def db_cache_simple(func):
         else:
             value = func(self)
             setattr(self, '_' + func.__name__, value)
-            self.save_base(raw=True)
+            db_cache._save(self, '_' + func.__name__)
             return value
     return wrapper
+
+
+def flush_db_cache(object):
+    """
+    Write values cached inside db_cache.deferred() with a single UPDATE
+    :returns: whether there was anything to write
+    :rtype: bool
+    """
+    dirty = object.__dict__.pop('_db_cache_dirty', None)
+    if not dirty:
+        return False
+    values = {}
+    for field_name in dirty:
+        try:
+            object._meta.get_field(field_name)
+        except FieldDoesNotExist:
+            # property over a model field, let the model serialize it
+            object.save_base(raw=True)
+            return True
+        values[field_name] = getattr(object, field_name)
+    object.__class__._base_manager.filter(pk=object.pk).update(**values)
+    return True
+
+
+def flush_db_cache_bulk(objects):
+    """
+    Flush deferred cached values of many instances in one transaction
+    :type objects: list
+    :returns: number of updated instances
+    :rtype: int
+    """
+    updated = 0
+    with transaction.atomic():
+        for object in objects:
+            updated += flush_db_cache(object)
+    return updated
+
+
+class NgramIndexField(models.BinaryField):
+    """
+    Stores n-gram index in a compact binary form, see axel.libs.ngram_index.
+    Accepts plain dicts on assignment and returns lazy NgramIndex objects.
+    """
+    __metaclass__ = models.SubfieldBase
+
+    def __init__(self, compress=True, *args, **kwargs):
+        """
+        :param compress: whether to zlib compress stored indexes
+        """
+        self.compress = compress
+        kwargs.setdefault('null', True)
+        super(NgramIndexField, self).__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, NgramIndex):
+            return value
+        if isinstance(value, dict):
+            return NgramIndex.from_dict(value, compress=self.compress)
+        if isinstance(value, unicode):
+            if value.startswith('{'):
+                value = value.encode('utf-8')
+            else:
+                # serialized form, see value_to_string
+                value = b64decode(value)
+        value = str(value)
+        if not value:
+            return None
+        if value.startswith('{'):
+            # index stored in the old JSON format, as text or as bytes after column conversion
+            return NgramIndex.from_dict(json.loads(value), compress=self.compress)
+        return NgramIndex(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = self.to_python(value)
+        if value is not None:
+            value = value.data
+        return super(NgramIndexField, self).get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        value = self._get_val_from_obj(obj)
+        if value is None:
+            return ''
+        return b64encode(value.data)
+
+
+class OffsetArrayField(models.BinaryField):
+    """
+    Stores a list of unsigned integers, like sorted text offsets, packed.
+    Accepts lists on assignment and returns array('I') objects, suitable for bisect.
+    """
+    __metaclass__ = models.SubfieldBase
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('null', True)
+        super(OffsetArrayField, self).__init__(*args, **kwargs)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, array):
+            return value
+        if isinstance(value, (list, tuple)):
+            return array('I', value)
+        if isinstance(value, unicode):
+            # serialized form, see value_to_string
+            value = b64decode(value)
+        offsets = array('I')
+        offsets.fromstring(str(value))
+        return offsets
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        value = self.to_python(value)
+        if value is not None:
+            value = value.tostring()
+        return super(OffsetArrayField, self).get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        value = self._get_val_from_obj(obj)
+        if value is None:
+            return ''
+        return b64encode(value.tostring())
+
+
+try:
+    from south.modelsinspector import add_introspection_rules
+    add_introspection_rules([([NgramIndexField], [], {'compress': ['compress', {'default': True}]}),
+                             ([OffsetArrayField], [], {})],
+                            [r'^axel\.articles\.utils\.db\.NgramIndexField',
+                             r'^axel\.articles\.utils\.db\.OffsetArrayField'])
+except ImportError:
+    pass
@@ -0,0 +1,149 @@
+"""Ranked conceptual search over the inverted concept index"""
+from __future__ import division
+from collections import defaultdict
+import heapq
+import math
+
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from axel.articles.models import Article, ConceptPostings, IndexedArticle, CLUSTERS_DICT
+
+
+RANKINGS = ('bm25', 'tfidf')
+# BM25 term frequency saturation and length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# number of articles or n-grams per query
+CHUNK_SIZE = 500
+
+
+def _triples(postings):
+    """
+    :type postings: array
+    :returns: (article id, concept count, article length) triples
+    :rtype: list
+    """
+    return [tuple(postings[i:i + 3]) for i in xrange(0, len(postings), 3)]
+
+
+def _flatten(triples):
+    """
+    :type triples: list
+    :rtype: list
+    """
+    return [value for triple in triples for value in triple]
+
+
+class ConceptIndex(object):
+    """
+    Inverted index from the concepts of a cluster to the articles containing them,
+    stored in ConceptPostings with document frequencies.
+    Ranks articles for a set of concepts by TF-IDF or BM25.
+    """
+
+    def __init__(self, cluster_id):
+        """
+        :param cluster_id: cluster id of the indexed articles
+        """
+        self.cluster_id = cluster_id
+        self.model = CLUSTERS_DICT[cluster_id]
+
+    def __len__(self):
+        """Number of indexed articles"""
+        return IndexedArticle.objects.filter(article__cluster_id=self.cluster_id).count()
+
+    def rebuild(self):
+        """
+        Index all articles of the cluster from scratch
+        :returns: number of indexed articles
+        :rtype: int
+        """
+        with transaction.atomic():
+            ConceptPostings.objects.filter(cluster_id=self.cluster_id).delete()
+            IndexedArticle.objects.filter(article__cluster_id=self.cluster_id).delete()
+            return self.add_articles()
+
+    def add_articles(self, article_ids=None):
+        """
+        Add articles that are not indexed yet, articles without collocations are skipped
+        :param article_ids: articles to add, all articles of the cluster by default
+        :returns: number of added articles
+        :rtype: int
+        """
+        new_ids = set(Article.objects.filter(cluster_id=self.cluster_id, indexed__isnull=True)
+                      .values_list('id', flat=True))
+        if article_ids is not None:
+            new_ids.intersection_update(article_ids)
+        new_ids = sorted(new_ids)
+
+        counts = defaultdict(dict)
+        lengths = defaultdict(int)
+        for i in range(0, len(new_ids), CHUNK_SIZE):
+            for article_id, ngram, count in self.model.objects.filter(
+                    article__in=new_ids[i:i + CHUNK_SIZE]).values_list('article', 'ngram', 'count'):
+                counts[ngram][article_id] = count
+                lengths[article_id] += count
+        if not lengths:
+            return 0
+
+        with transaction.atomic():
+            IndexedArticle.objects.bulk_create([IndexedArticle(article_id=article_id, length=length)
+                                                for article_id, length in lengths.iteritems()],
+                                               batch_size=CHUNK_SIZE)
+            ngrams = counts.keys()
+            existing = {}
+            for i in range(0, len(ngrams), CHUNK_SIZE):
+                for postings in ConceptPostings.objects.filter(cluster_id=self.cluster_id,
+                                                               ngram__in=ngrams[i:i + CHUNK_SIZE]):
+                    existing[postings.ngram] = postings
+            new_postings = []
+            for ngram, article_counts in counts.iteritems():
+                triples = [(article_id, count, lengths[article_id])
+                           for article_id, count in article_counts.iteritems()]
+                if ngram in existing:
+                    postings = existing[ngram]
+                    triples = sorted(_triples(postings.postings) + triples)
+                    ConceptPostings.objects.filter(pk=postings.pk)\
+                        .update(df=len(triples), postings=_flatten(triples))
+                else:
+                    new_postings.append(ConceptPostings(cluster_id=self.cluster_id, ngram=ngram,
+                                                        df=len(triples),
+                                                        postings=_flatten(sorted(triples))))
+            ConceptPostings.objects.bulk_create(new_postings, batch_size=CHUNK_SIZE)
+        return len(lengths)
+
+    def search(self, concepts, k=50, ranking='bm25'):
+        """
+        Rank indexed articles containing any of the concepts
+        :type concepts: list
+        :param k: number of returned articles
+        :param ranking: bm25 or tfidf
+        :returns: (article id, score) pairs, best first
+        :rtype: list
+        """
+        if ranking not in RANKINGS:
+            raise ValueError('Unknown ranking: {0}'.format(ranking))
+        stats = IndexedArticle.objects.filter(article__cluster_id=self.cluster_id)\
+            .aggregate(documents=Count('pk'), avg_length=Avg('length'))
+        total_docs = stats['documents']
+        if not total_docs:
+            return []
+        avg_length = stats['avg_length'] or 1
+
+        scores = defaultdict(float)
+        for postings in ConceptPostings.objects.filter(cluster_id=self.cluster_id,
+                                                       ngram__in=set(concepts)):
+            df = postings.df
+            if ranking == 'tfidf':
+                idf = math.log(total_docs / df)
+            else:
+                idf = math.log((total_docs - df + 0.5) / (df + 0.5) + 1)
+            for article_id, tf, length in _triples(postings.postings):
+                if ranking == 'tfidf':
+                    scores[article_id] += tf * idf
+                else:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[article_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        # ties are broken by the article id
+        return heapq.nlargest(k, scores.iteritems(), key=lambda item: (item[1], -item[0]))
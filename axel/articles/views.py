@@ -6,7 +6,9 @@ from django.views.generic.edit import FormView
 from django.views.generic import ListView, DetailView, TemplateView
 
 from axel.articles.forms import PDFUploadForm, ConceptAutocompleteForm
-from axel.articles.models import Article
+from axel.articles.models import Article, CLUSTERS_DICT
+from axel.articles.utils.concepts_index import get_autocomplete
+from axel.articles.utils.search import ConceptIndex, RANKINGS
 from axel.libs.mixins import JSONResponseMixin
 from axel.stats.models import Collocations
 
@@ -60,8 +62,8 @@ class ConceptAutocompleteView(JSONResponseMixin, TemplateView):
         if form.is_valid():
             query = form.cleaned_data['query']
             # search concepts
-            results = Collocations.objects.filter(ngram__icontains=query)
-            results = [colloc.ngram+' '+str(colloc.count) for colloc in results]
+            results = get_autocomplete(Collocations).search(query)
+            results = [ngram+' '+str(count) for ngram, count in results]
             context = {'results': results}
             return JSONResponseMixin.render_to_response(self, context)
         raise Http404
@@ -69,8 +71,19 @@ class ConceptAutocompleteView(JSONResponseMixin, TemplateView):
 
 @require_POST
 def filter_articles_view(request):
-    """View that shows filtered articles based on concepts"""
+    """View that shows articles containing the concepts, ranked by BM25 or TF-IDF"""
     concepts = request.POST.getlist('concepts')
-    articles = Article.objects.filter(articlecollocation__ngram__in=concepts).distinct()
+    cluster_id = request.POST.get('cluster', Collocations.CLUSTER_ID)
+    ranking = request.POST.get('ranking', 'bm25')
+    if cluster_id not in CLUSTERS_DICT or ranking not in RANKINGS:
+        raise Http404
+    index = ConceptIndex(cluster_id)
+    if len(index):
+        ranked = index.search(concepts, k=ArticleList.paginate_by, ranking=ranking)
+        articles = Article.objects.in_bulk([article_id for article_id, _ in ranked])
+        articles = [articles[article_id] for article_id, _ in ranked]
+    else:
+        # index is not built yet
+        articles = Article.objects.filter(articlecollocation__ngram__in=concepts).distinct()
     return render_to_response('articles/article_list.html', {'articles': articles},
                         context_instance=RequestContext(request))
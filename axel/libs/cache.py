@@ -0,0 +1,164 @@
+"""Persistent key-value cache in a SQLite file, shared between threads and processes"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SQLiteCache(object):
+    """
+    JSON values stored by string keys in a single SQLite table.
+    Every thread and forked process opens its own connection to the file.
+    Entries expire after ttl seconds, the oldest ones are evicted when max_entries is exceeded.
+    """
+    # entries added between the size checks
+    EVICT_EVERY = 100
+
+    def __init__(self, path, ttl=None, max_entries=None):
+        """
+        :param path: database file, created with its directory if missing
+        :type path: str
+        :param ttl: seconds an entry is valid for, forever if None
+        :param max_entries: maximum number of entries, unbounded if None
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._sets = 0
+
+    @staticmethod
+    def make_key(kind, resource):
+        """
+        Content-addressed key of the resource lookup
+        :param kind: type of the lookup, like wiki_categories
+        :type resource: unicode
+        :rtype: str
+        """
+        return hashlib.sha1(u'{0}\n{1}'.format(kind, resource).encode('utf-8')).hexdigest()
+
+    def _connection(self):
+        """
+        :rtype: sqlite3.Connection
+        """
+        pid, connection = getattr(self._local, 'connection', (None, None))
+        if pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('CREATE TABLE IF NOT EXISTS cache '
+                               '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)')
+            self._add_created_column(connection)
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_created ON cache (created)')
+            connection.commit()
+            self._local.connection = (os.getpid(), connection)
+        return connection
+
+    @staticmethod
+    def _add_created_column(connection):
+        """Upgrade a table created before expiration was supported, its entries become fresh"""
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(cache)')]
+        if 'created' in columns:
+            return
+        try:
+            connection.execute('ALTER TABLE cache ADD COLUMN created REAL NOT NULL DEFAULT 0')
+        except sqlite3.OperationalError as e:
+            # added by another connection meanwhile
+            if 'duplicate column' not in str(e):
+                raise
+            return
+        connection.execute('UPDATE cache SET created = ?', (time.time(),))
+        connection.commit()
+
+    def _min_created(self):
+        if self.ttl is None:
+            return 0
+        return time.time() - self.ttl
+
+    def get(self, key, default=None):
+        """
+        :type key: unicode
+        :returns: cached value, default if missing or expired
+        """
+        row = self._connection().execute('SELECT value FROM cache WHERE key = ? AND created >= ?',
+                                         (key, self._min_created())).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def __contains__(self, key):
+        return self._connection().execute('SELECT 1 FROM cache WHERE key = ? AND created >= ?',
+                                          (key, self._min_created())).fetchone() is not None
+
+    def set(self, key, value):
+        """
+        :type key: unicode
+        :param value: JSON serializable value
+        """
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)',
+                           (key, json.dumps(value), time.time()))
+        connection.commit()
+        self._sets += 1
+        if not self._sets % self.EVICT_EVERY:
+            self.evict()
+
+    def get_or_set(self, key, func):
+        """
+        :param func: computes the value if it is not cached
+        """
+        value = self.get(key)
+        if value is None:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def evict(self):
+        """
+        Remove expired entries and the oldest ones above max_entries
+        :returns: number of removed entries
+        :rtype: int
+        """
+        connection = self._connection()
+        removed = connection.execute('DELETE FROM cache WHERE created < ?',
+                                     (self._min_created(),)).rowcount
+        if self.max_entries is not None:
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                removed += connection.execute(
+                    'DELETE FROM cache WHERE key IN '
+                    '(SELECT key FROM cache ORDER BY created, rowid LIMIT ?)', (excess,)).rowcount
+        connection.commit()
+        return removed
+
+    def __len__(self):
+        return self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def dump(self, path):
+        """
+        Write all valid entries to a JSON file
+        :returns: number of written entries
+        """
+        rows = self._connection().execute('SELECT key, value FROM cache WHERE created >= ?',
+                                          (self._min_created(),)).fetchall()
+        with open(path, 'w') as dump_file:
+            json.dump([[key, json.loads(value)] for key, value in rows], dump_file)
+        return len(rows)
+
+    def load(self, path):
+        """
+        Pre-seed the cache from a JSON file written by dump, seeded entries are fresh
+        :returns: number of loaded entries
+        """
+        with open(path) as dump_file:
+            rows = json.load(dump_file)
+        connection = self._connection()
+        now = time.time()
+        connection.executemany('INSERT OR REPLACE INTO cache (key, value, created) VALUES (?, ?, ?)',
+                               [(key, json.dumps(value), now) for key, value in rows])
+        connection.commit()
+        self.evict()
+        return len(rows)
@@ -1,38 +1,175 @@
 """Match extracted collocation with DBPedia entities"""
-
+import atexit
 from datetime import date
+import json
+import Queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
 from lxml import etree
 import requests
 from suds.client import Client
 from suds.xsd.doctor import Import, ImportDoctor
 
+from axel.libs.cache import SQLiteCache
 
-DBLP_URL = 'http://dblp.l3s.de/WS/aspl2.php?wsdl'
-imp = Import('http://schemas.xmlsoap.org/soap/encoding/',
-             location='http://schemas.xmlsoap.org/soap/encoding/')
-dblp_client = Client(DBLP_URL,plugins=[ImportDoctor(imp)])
 
-DBPEDIA_REQ = u'http://lookup.dbpedia.org/api/search' \
-              u'.asmx/KeywordSearch?QueryClass=&QueryString={0}&MaxHits=1'
+_dblp_client = None
 
 
-def perform_match(collocation):
+def get_dblp_client():
     """
-    :type collocation: Collocation
+    SOAP client is created on first use, it downloads the service description
+    :returns: DBLP client, None if disabled in settings
+    :rtype: Client
+    """
+    global _dblp_client
+    if _dblp_client is None and settings.DBLP_WSDL_URL:
+        imp = Import('http://schemas.xmlsoap.org/soap/encoding/',
+                     location='http://schemas.xmlsoap.org/soap/encoding/')
+        _dblp_client = Client(settings.DBLP_WSDL_URL, plugins=[ImportDoctor(imp)])
+    return _dblp_client
+
+
+def match_ngram(ngram):
+    """
+    :type ngram: unicode
+    :returns: names of the sources with the ngram as entity
+    :rtype: list
     """
     source = []
     # perform search using dbpedia
-    r = requests.get(DBPEDIA_REQ.format(collocation.ngram))
+    r = requests.get(settings.DBPEDIA_LOOKUP_URL,
+                     params={'QueryClass': '', 'QueryString': ngram, 'MaxHits': 1})
+    r.raise_for_status()
     xml = etree.fromstring(r.text.replace('encoding="utf-8"', ''))
     result = xml.find('.//{http://lookup.dbpedia.org/}Label')
     desc = xml.find('.//{http://lookup.dbpedia.org/}Description')
-    if result is not None and desc is not None and result.text.lower() == collocation.ngram:
+    if result is not None and desc is not None and result.text.lower() == ngram:
         source.append("dbpedia")
 
     # perform keyword search from dblp
-    dblp_res = dblp_client.service.all_keywords_year(searchTerm=collocation.ngram, limit=1,
-                                                     startYear=1999, endYear=date.today().year)
-    if dblp_res and dblp_res[0].keyword.lower() == collocation.ngram:
-        source.append("dblp")
+    dblp_client = get_dblp_client()
+    if dblp_client is not None:
+        dblp_res = dblp_client.service.all_keywords_year(searchTerm=ngram, limit=1,
+                                                         startYear=1999,
+                                                         endYear=date.today().year)
+        if dblp_res and dblp_res[0].keyword.lower() == ngram:
+            source.append("dblp")
 
     return source
+
+
+def perform_match(collocation):
+    """
+    :type collocation: Collocation
+    """
+    return match_ngram(collocation.ngram)
+
+
+def save_source(model, pk, source):
+    """
+    Store matched source of the collocation without touching its other fields
+    :type model: Collocation
+    """
+    try:
+        colloc = model.objects.only('_extra_fields').get(pk=pk)
+    except model.DoesNotExist:
+        return
+    extra_fields = colloc.extra_fields
+    extra_fields['source'] = source
+    model.objects.filter(pk=pk).update(_extra_fields=json.dumps(extra_fields))
+
+
+class SourceMatcher(object):
+    """
+    Background queue matching collocations with external sources.
+    Lookups run in worker threads with retries, results are kept in a persistent cache
+    shared by all processes, so every n-gram is looked up once.
+    Pending collocations are matched before the process exits.
+    """
+
+    def __init__(self, threads=None, retries=None, cache_path=None, delay=1.):
+        """
+        :param threads: number of worker threads, matches in the calling thread if 0,
+        settings.SOURCE_MATCH_THREADS by default
+        :param retries: number of retries of a failed lookup
+        :param cache_path: result cache file, settings.SOURCE_MATCH_CACHE by default
+        :param delay: seconds before the first retry, doubled for every next one
+        """
+        self.threads = settings.SOURCE_MATCH_THREADS if threads is None else threads
+        self.retries = settings.SOURCE_MATCH_RETRIES if retries is None else retries
+        self.cache = SQLiteCache(cache_path or settings.SOURCE_MATCH_CACHE)
+        self.delay = delay
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def match(self, ngram):
+        """
+        :type ngram: unicode
+        :returns: cached or looked up sources of the ngram
+        :rtype: list
+        """
+        source = self.cache.get(ngram)
+        if source is not None:
+            return source
+        for attempt in range(self.retries + 1):
+            try:
+                source = match_ngram(ngram)
+                break
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.delay * 2 ** attempt)
+        self.cache.set(ngram, source)
+        return source
+
+    def _process(self, model, pk, ngram):
+        try:
+            save_source(model, pk, self.match(ngram))
+        except Exception as e:
+            print u'Source matching failed for {0}: {1!r}'.format(ngram, e)
+
+    def _work(self):
+        while True:
+            task = self._queue.get()
+            try:
+                self._process(*task)
+            finally:
+                self._queue.task_done()
+                if self._queue.empty():
+                    # do not keep idle connections of the worker open
+                    connection.close()
+
+    def _start(self):
+        with self._lock:
+            if self._workers:
+                return
+            for _ in range(self.threads):
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            atexit.register(self.join)
+
+    def submit(self, collocation):
+        """
+        Queue the saved collocation for matching, its source is stored when found
+        :type collocation: Collocation
+        """
+        task = (collocation.__class__, collocation.pk, collocation.ngram)
+        if not self.threads:
+            self._process(*task)
+            return
+        self._start()
+        self._queue.put(task)
+
+    def join(self):
+        """Wait until all queued collocations are matched"""
+        self._queue.join()
+
+
+source_matcher = SourceMatcher()
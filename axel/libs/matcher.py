@@ -0,0 +1,109 @@
+"""Aho-Corasick automaton to find many n-grams in a text at once"""
+from collections import defaultdict
+
+
+class NgramMatcher(object):
+    """
+    Character level Aho-Corasick automaton built once for a set of n-grams.
+    A single scan of a text reports occurrences of all n-grams, including overlapping ones,
+    so the cost does not depend on the number of n-grams.
+    """
+
+    def __init__(self, ngrams):
+        """
+        :param ngrams: n-grams to search for, empty ones are ignored
+        :type ngrams: list
+        """
+        self.ngrams = []
+        goto = [{}]
+        outputs = [()]
+        for ngram in ngrams:
+            if not ngram:
+                continue
+            state = 0
+            for char in ngram:
+                next_state = goto[state].get(char)
+                if next_state is None:
+                    next_state = goto[state][char] = len(goto)
+                    goto.append({})
+                    outputs.append(())
+                state = next_state
+            if not outputs[state]:
+                outputs[state] = (ngram,)
+                self.ngrams.append(ngram)
+
+        # breadth-first, so failure states are always complete before they are used
+        fail = [0] * len(goto)
+        queue = list(goto[0].itervalues())
+        for state in queue:
+            for char, next_state in goto[state].iteritems():
+                queue.append(next_state)
+                fail_state = fail[state]
+                while fail_state and char not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+                fail_state = goto[fail_state].get(char, 0)
+                if fail_state == next_state:
+                    fail_state = 0
+                fail[next_state] = fail_state
+                outputs[next_state] += outputs[fail_state]
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+
+    def __len__(self):
+        return len(self.ngrams)
+
+    def finditer(self, text):
+        """
+        GENERATOR
+        :returns: (start offset, ngram) for every occurrence, ordered by the end offset
+        """
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                for ngram in outputs[state]:
+                    yield i + 1 - len(ngram), ngram
+
+    def find_all(self, text):
+        """
+        :returns: sorted start offsets of every n-gram found in the text
+        :rtype: dict
+        """
+        offsets = defaultdict(list)
+        for start, ngram in self.finditer(text):
+            offsets[ngram].append(start)
+        return offsets
+
+    def count(self, text):
+        """
+        Count non-overlapping occurrences of all n-grams, same as text.count(ngram)
+        :rtype: dict
+        """
+        counts = dict.fromkeys(self.ngrams, 0)
+        next_start = dict.fromkeys(self.ngrams, 0)
+        for start, ngram in self.finditer(text):
+            if start >= next_start[ngram]:
+                counts[ngram] += 1
+                next_start[ngram] = start + len(ngram)
+        return counts
+
+    def containing(self, ngrams):
+        """
+        Find which of the given n-grams contain the matcher n-grams,
+        same as filtering by `ngram in bigger_ngram`
+        :type ngrams: list
+        :returns: dict from the n-gram to the list of other n-grams containing it, in given order
+        :rtype: dict
+        """
+        containing = defaultdict(list)
+        for bigger_ngram in ngrams:
+            for ngram in set([ngram for _, ngram in self.finditer(bigger_ngram)]):
+                if ngram != bigger_ngram:
+                    containing[ngram].append(bigger_ngram)
+        return containing
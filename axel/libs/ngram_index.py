@@ -0,0 +1,222 @@
+"""Compact serialized n-gram index with lazy lookups"""
+from bisect import bisect_right
+from itertools import izip
+import struct
+import zlib
+
+
+MAGIC = 'NGI\x01'
+FLAG_COMPRESSED = 1
+# every BLOCK_SIZE-th record gets a checkpoint used for binary search
+BLOCK_SIZE = 16
+
+_HEADER = struct.Struct('<III')
+_CHECKPOINT = struct.Struct('<II')
+
+
+def _encode_key(key):
+    """
+    :type key: unicode
+    :rtype: str
+    """
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return key
+
+
+def _encode_varint(value, buf):
+    """
+    Append unsigned LEB128 representation of value to the buffer
+    :type value: int
+    :type buf: list
+    """
+    while value > 0x7f:
+        buf.append(chr(value & 0x7f | 0x80))
+        value >>= 7
+    buf.append(chr(value))
+
+
+def _decode_varints(data):
+    """
+    :param data: concatenated varints
+    :type data: str
+    :rtype: list
+    """
+    data = bytearray(data)
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            values.append(value)
+            value = 0
+            shift = 0
+        else:
+            shift += 7
+    return values
+
+
+def _decode_varint(data, pos):
+    """
+    :returns: decoded value and position right after it
+    :rtype: tuple
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class NgramIndex(object):
+    """
+    Read-only n-gram index backed by a compact binary string.
+
+    Payload layout: header (records count, checkpoints count, keys block length),
+    checkpoint table with key/count offsets of every BLOCK_SIZE-th record,
+    sorted utf-8 keys each terminated by a newline, then counts as varints in key order.
+    Lookups bisect the checkpoint keys and scan a single block, so `ngram in index`
+    and `index[ngram]` never materialize the whole dict.
+    """
+
+    def __init__(self, data):
+        """
+        :param data: serialized index, as produced by NgramIndex.from_dict
+        :type data: str
+        """
+        data = str(data)
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError('Not a serialized n-gram index')
+        self.data = data
+        payload = data[len(MAGIC) + 1:]
+        if ord(data[len(MAGIC)]) & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        self._payload = payload
+        self._len, self._checkpoints, keys_len = _HEADER.unpack_from(payload)
+        self._keys_start = _HEADER.size + self._checkpoints * _CHECKPOINT.size
+        self._counts_start = self._keys_start + keys_len
+        self._checkpoint_offsets = None
+        self._checkpoint_keys = None
+
+    @classmethod
+    def from_dict(cls, index, compress=False):
+        """
+        Serialize n-gram index
+        :param index: n-gram index with string keys
+        :type index: dict
+        :param compress: whether to zlib compress the payload
+        :rtype: NgramIndex
+        """
+        items = sorted([(_encode_key(key), count) for key, count in index.iteritems()])
+        checkpoints = []
+        keys_len = 0
+        counts = []
+        for i, (key, count) in enumerate(items):
+            if not i % BLOCK_SIZE:
+                checkpoints.append(_CHECKPOINT.pack(keys_len, len(counts)))
+            keys_len += len(key) + 1
+            _encode_varint(count, counts)
+        keys = ''.join([key + '\n' for key, _ in items])
+
+        payload = _HEADER.pack(len(items), len(checkpoints), keys_len) + ''.join(checkpoints) \
+            + keys + ''.join(counts)
+        flags = 0
+        if compress:
+            payload = zlib.compress(payload)
+            flags |= FLAG_COMPRESSED
+        return cls(MAGIC + chr(flags) + payload)
+
+    def __reduce__(self):
+        return self.__class__, (self.data,)
+
+    def __len__(self):
+        return self._len
+
+    def _load_checkpoints(self):
+        """Read first keys of each block, only a 1/BLOCK_SIZE fraction of the index"""
+        self._checkpoint_offsets = []
+        self._checkpoint_keys = []
+        for i in xrange(self._checkpoints):
+            key_pos, count_pos = _CHECKPOINT.unpack_from(self._payload,
+                                                         _HEADER.size + i * _CHECKPOINT.size)
+            key_pos += self._keys_start
+            self._checkpoint_offsets.append((key_pos, count_pos + self._counts_start))
+            self._checkpoint_keys.append(self._payload[key_pos:self._payload.find('\n', key_pos)])
+
+    def _lookup(self, key):
+        """
+        :returns: count for the key, None if not present
+        """
+        if self._checkpoint_keys is None:
+            self._load_checkpoints()
+        key = _encode_key(key)
+        block = bisect_right(self._checkpoint_keys, key) - 1
+        if block < 0:
+            return None
+        payload = self._payload
+        key_pos, count_pos = self._checkpoint_offsets[block]
+        for _ in xrange(min(BLOCK_SIZE, self._len - block * BLOCK_SIZE)):
+            key_end = payload.find('\n', key_pos)
+            current_key = payload[key_pos:key_end]
+            if current_key == key:
+                return _decode_varint(payload, count_pos)[0]
+            elif current_key > key:
+                break
+            key_pos = key_end + 1
+            # skip the count of the current record
+            while ord(payload[count_pos]) & 0x80:
+                count_pos += 1
+            count_pos += 1
+        return None
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def __getitem__(self, key):
+        count = self._lookup(key)
+        if count is None:
+            raise KeyError(key)
+        return count
+
+    def get(self, key, default=None):
+        count = self._lookup(key)
+        if count is None:
+            return default
+        return count
+
+    def iteritems(self):
+        """Iterate over (ngram, count) pairs in sorted order"""
+        if not self._len:
+            return iter([])
+        keys = self._payload[self._keys_start:self._counts_start - 1].decode('utf-8').split(u'\n')
+        counts = self._payload[self._counts_start:]
+        if len(counts) == self._len:
+            # fast path, all counts fit into a single byte
+            counts = bytearray(counts)
+        else:
+            counts = _decode_varints(counts)
+        return izip(keys, counts)
+
+    def iterkeys(self):
+        for key, _ in self.iteritems():
+            yield key
+
+    __iter__ = iterkeys
+
+    def itervalues(self):
+        for _, count in self.iteritems():
+            yield count
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
@@ -104,6 +104,18 @@ def collocations(index, cutoff=2):
     :type index: dict
     :rtype list
     """
+    # generate possible n-grams
+    filtered_collocs = _update_ngram_counts(_generate_possible_ngrams(
+        _bigram_candidates(index, cutoff), index), index)
+    return filtered_collocs
+
+
+def _bigram_candidates(index, cutoff=2):
+    """
+    Select bigrams from n-gram index that can start collocations
+    :type index: dict
+    :rtype: dict
+    """
 
     def filter_punkt(word):
         return _PUNKT_RE.match(word)
@@ -126,16 +138,34 @@ def collocations(index, cutoff=2):
     finder.apply_word_filter(filter_len)
     finder.apply_word_filter(lambda w: w in _STOPWORDS)
 
-    filtered_collocs = finder.ngram_fd
-    """:type: dict"""
+    return finder.ngram_fd
 
-    # generate possible n-grams
-    filtered_collocs = _update_ngram_counts(_generate_possible_ngrams(filtered_collocs, index),
-                                            index)
-    return filtered_collocs
+
+# n-gram length -> word spans of all its shorter n-grams, filled by _sub_ngrams
+_SUB_NGRAM_SPANS = {}
+
+
+def _sub_ngrams(ngram, max_split=5):
+    """
+    Get all shorter n-grams contained in the ngram,
+    same as the keys of build_ngram_index(ngram) without the ngram itself
+    :type ngram: unicode
+    :rtype: set
+    """
+    words = ngram.split()
+    words_len = len(words)
+    if words_len > max_split or _PUNKT_RE.search(ngram):
+        # n-grams do not span punctuation, the index is split in this rare case
+        return set(sorted(_build_ngram_index_untimed(ngram, max_split).keys(),
+                          key=lambda x: len(x))[:-1])
+    spans = _SUB_NGRAM_SPANS.get(words_len)
+    if spans is None:
+        spans = _SUB_NGRAM_SPANS[words_len] = [(i, j) for i in range(words_len)
+                                               for j in range(i + 2, words_len + 1)
+                                               if j - i < words_len]
+    return set([' '.join(words[i:j]) for i, j in spans])
 
 
-@print_timing
 def _update_ngram_counts(ngrams, index):
     """
     Create a dict and fill in the correct counts for all the ngrams using ngram index
@@ -155,60 +185,76 @@ def _update_ngram_counts(ngrams, index):
         ngram_counts[ngram] = index[ngram]
 
     for ngram in ngrams:
-        if ngram_counts[ngram] == 0:
+        count = ngram_counts[ngram]
+        if count == 0:
             continue
-        for ngram1 in sorted(build_ngram_index(ngram).keys(), key=lambda x: len(x))[:-1]:
+        for ngram1 in _sub_ngrams(ngram):
             if ngram1 in ngram_counts:
-                ngram_counts[ngram1] -= ngram_counts[ngram]
+                ngram_counts[ngram1] -= count
     return ngram_counts
 
+# undecorated versions are used where print_timing output would distort the measurement
+_update_ngram_counts_untimed = _update_ngram_counts
+_update_ngram_counts = print_timing(_update_ngram_counts)
+
 
 @print_timing
 def _generate_possible_ngrams(collocs, index):
     """
-    Recursively generate all possible n-grams from list of bigrams, without counts,
-    we will add them later
+    Generate all possible n-grams from list of bigrams, without counts, we will add them later.
+    Two n-grams are joined when the leading words of one are the trailing words of another
+    and they have no other words in common, joined n-gram should be present in the index.
     :param collocs: set of bigrams
     :param index: ngram index of the text with counts
     :type collocs: set
     :type index: dict
+    :rtype: set
+    RATIONAL: joins are looked up in the indexes of leading/trailing word sets, and only n-grams
+    created on the previous step are joined, instead of comparing all pairs until no growth.
     """
-    possible_ngrams = set()
-    collocs_items = list(collocs)
-    total_len = len(collocs_items)
-    for i in range(total_len):
-        bigram_i = collocs_items[i]
-        for j in range(i + 1, total_len):
-            bigram_j = collocs_items[j]
-
-            inter = set(bigram_i).intersection(bigram_j)
-            inter_len = len(inter)
-            if not inter:
-                continue
-
-            # check intersection does not fully contains one of the n-grams
-            if inter_len == min((len(bigram_i), len(bigram_j))):
-                continue
-
-            # determine how to merge n-grams
-            bigram_s, bigram_e = None, None
-            if set(bigram_i[:inter_len]) == inter and set(bigram_j[-inter_len:]) == inter:
-                bigram_s, bigram_e = bigram_i, bigram_j
-            elif set(bigram_j[:inter_len]) == inter and set(bigram_i[-inter_len:]) == inter:
-                bigram_s, bigram_e = bigram_j, bigram_i
-
-            if bigram_s and bigram_e:
-                new_ngram = bigram_e + bigram_s[inter_len:]
-                # Check new colocation actually present in text
-                if not (new_ngram in collocs) and ' '.join(new_ngram) in index:
-                    possible_ngrams.add(new_ngram)
-
-    # create new set
-    possible_ngrams.update(collocs)
-    if len(possible_ngrams) == len(collocs):
-        return possible_ngrams
-    else:
-        return _generate_possible_ngrams(possible_ngrams, index)
+    possible_ngrams = set(collocs)
+    # leading and trailing word sets -> n-grams, words should be different inside a set
+    starts_index = defaultdict(list)
+    ends_index = defaultdict(list)
+
+    def add_to_indexes(ngram):
+        for inter_len in range(1, len(ngram)):
+            start, end = frozenset(ngram[:inter_len]), frozenset(ngram[-inter_len:])
+            if len(start) == inter_len:
+                starts_index[start].append(ngram)
+            if len(end) == inter_len:
+                ends_index[end].append(ngram)
+
+    def join(bigram_s, bigram_e, inter, new_ngrams):
+        # check both n-grams do not have other common words
+        if set(bigram_s).intersection(bigram_e) == inter:
+            new_ngram = bigram_e + bigram_s[len(inter):]
+            # Check new colocation actually present in text
+            if new_ngram not in possible_ngrams and ' '.join(new_ngram) in index:
+                new_ngrams.add(new_ngram)
+
+    for ngram in possible_ngrams:
+        add_to_indexes(ngram)
+
+    frontier = possible_ngrams
+    while frontier:
+        new_ngrams = set()
+        for ngram in frontier:
+            for inter_len in range(1, len(ngram)):
+                start, end = frozenset(ngram[:inter_len]), frozenset(ngram[-inter_len:])
+                if len(start) == inter_len:
+                    for ngram_e in ends_index.get(start, ()):
+                        if ngram_e != ngram:
+                            join(ngram, ngram_e, start, new_ngrams)
+                if len(end) == inter_len:
+                    for ngram_s in starts_index.get(end, ()):
+                        if ngram_s != ngram:
+                            join(ngram_s, ngram, end, new_ngrams)
+        for ngram in new_ngrams:
+            add_to_indexes(ngram)
+        possible_ngrams.update(new_ngrams)
+        frontier = new_ngrams
+    return possible_ngrams
 
 
 @print_timing
@@ -237,22 +283,46 @@ def _split_ngrams(text):
     return re.split(_PUNKT_RE, text)
 
 
-@print_timing
-def build_ngram_index(text, max_split=5):
+def build_ngram_index(text, max_split=5, vocabulary=None):
     """
-    Build n-grams from text up to max len in the db, *with actual counts*
+    Build n-grams from text up to max len in the db, *with actual counts*.
+    All n-grams of a sentence are emitted in a single sliding-window pass over its tokens.
     :type text: unicode
+    :param vocabulary: optional token to integer id mapping, when passed n-grams are keyed
+    by tuples of token ids instead of joined strings, new tokens are added to the mapping
+    :type vocabulary: dict
     :rtype: defaultdict
     """
+    all_ngrams = defaultdict(int)
+    # n-grams cannot span punctuation, so each split part is treated separately
+    for sentence in _split_ngrams(text):
+        words = sentence.split()
+        if vocabulary is not None:
+            words = tuple([vocabulary.setdefault(word, len(vocabulary)) for word in words])
+            for i in xrange(len(words) - 1):
+                for j in xrange(i + 2, min(i + max_split, len(words)) + 1):
+                    all_ngrams[words[i:j]] += 1
+        else:
+            for i in xrange(len(words) - 1):
+                ngram = words[i]
+                # grow the n-gram by one word at a time instead of re-joining
+                for word in words[i + 1:i + max_split]:
+                    ngram = ngram + ' ' + word
+                    all_ngrams[ngram] += 1
+    return all_ngrams
 
-    # First step - sentence split.
-    text = _split_ngrams(text)
+_build_ngram_index_untimed = build_ngram_index
+build_ngram_index = print_timing(build_ngram_index)
 
-    # Second step - ngram generation
-    all_ngrams = defaultdict(lambda: 0)
-    for n in range(2, max_split + 1):
-        for sentence in text:
-            ngrams = nltk.ngrams(sentence.split(), n)
-            for ngram in ngrams:
-                all_ngrams[(' '.join(ngram))] += 1
-    return all_ngrams
+
+def decode_ngram_index(index, vocabulary):
+    """
+    Convert n-gram index built with token ids back to the string keyed form
+    :type index: dict
+    :param vocabulary: token to integer id mapping used to build the index
+    :type vocabulary: dict
+    :rtype: dict
+    """
+    tokens = dict([(token_id, token) for token, token_id in vocabulary.iteritems()])
+    return dict([(' '.join([tokens[token_id] for token_id in ngram]), count)
+                 for ngram, count in index.iteritems()])
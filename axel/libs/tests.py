@@ -0,0 +1,321 @@
+"""Unit-tests for libs app"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+import urlparse
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from axel.libs import nlp, wiki
+from axel.libs.cache import SQLiteCache
+from axel.libs.external_match import SourceMatcher
+from axel.libs.matcher import NgramMatcher
+from axel.libs.ngram_index import NgramIndex
+from axel.libs.utils import get_contexts, get_contexts_ngrams, get_sentences, \
+    _get_contexts_ngrams_regex
+
+
+class NgramIndexTest(TestCase):
+    """Tests n-gram index construction"""
+
+    def test_build_ngram_index(self):
+        """Test all 2..5-grams are counted and do not span punctuation"""
+        index = nlp.build_ngram_index(u'latent semantic indexing model. latent semantic indexing')
+        self.assertEqual(index[u'latent semantic'], 2)
+        self.assertEqual(index[u'latent semantic indexing'], 2)
+        self.assertEqual(index[u'semantic indexing model'], 1)
+        self.assertNotIn(u'model latent', index)
+        self.assertEqual(len(index), 6)
+
+    def test_build_ngram_index_vocabulary(self):
+        """Test integer id mode produces the same index"""
+        text = u'a b c d e f, b c d'
+        vocabulary = {}
+        index = nlp.build_ngram_index(text, vocabulary=vocabulary)
+        self.assertEqual(index[(vocabulary[u'b'], vocabulary[u'c'])], 2)
+        self.assertEqual(nlp.decode_ngram_index(index, vocabulary),
+                         dict(nlp.build_ngram_index(text)))
+
+
+class NgramIndexSerializationTest(TestCase):
+    """Tests compact n-gram index format"""
+
+    def test_lookup(self):
+        """Test lazy lookups and iteration match the original dict"""
+        index = dict(nlp.build_ngram_index(u'a b c d e f g h i j k l m n o p q r s t. na\xefve bayes'))
+        index[u'large count'] = 100000
+        for compress in (False, True):
+            ngram_index = NgramIndex.from_dict(index, compress=compress)
+            self.assertEqual(len(ngram_index), len(index))
+            for ngram, count in index.iteritems():
+                self.assertIn(ngram, ngram_index)
+                self.assertEqual(ngram_index[ngram], count)
+            self.assertNotIn(u'a c', ngram_index)
+            self.assertNotIn(u'zzz', ngram_index)
+            self.assertRaises(KeyError, lambda: ngram_index[u'a'])
+            self.assertEqual(dict(NgramIndex(ngram_index.data).iteritems()), index)
+
+
+class PossibleNgramsTest(TestCase):
+    """Tests generation of longer n-grams from collocation candidates"""
+
+    def test_chain(self):
+        """Test overlapping bigrams are joined only when the result is in the index"""
+        index = nlp.build_ngram_index(u'a b c d. b c e')
+        collocs = {(u'a', u'b'), (u'b', u'c'), (u'c', u'd'), (u'c', u'e')}
+        self.assertEqual(nlp._generate_possible_ngrams(collocs, index),
+                         collocs | {(u'a', u'b', u'c'), (u'b', u'c', u'd'),
+                                    (u'a', u'b', u'c', u'd'), (u'b', u'c', u'e')})
+
+    def test_unordered_overlap(self):
+        """Test overlap is compared as a set of words, as the pairwise version did"""
+        index = nlp.build_ngram_index(u'z q p r')
+        collocs = {(u'p', u'q', u'r'), (u'z', u'q', u'p')}
+        self.assertEqual(nlp._generate_possible_ngrams(collocs, index),
+                         collocs | {(u'z', u'q', u'p', u'r')})
+
+
+class NgramCountsTest(TestCase):
+    """Tests correction of n-gram counts by longer n-grams"""
+
+    def test_sub_ngrams(self):
+        """Test sub-n-grams match the n-gram index of the n-gram"""
+        for ngram in (u'a b', u'a b c d', u'a b a b', u'a b c d e f', u'a b, c d'):
+            self.assertEqual(nlp._sub_ngrams(ngram),
+                             set(sorted(nlp.build_ngram_index(ngram).keys(), key=len)[:-1]))
+
+    def test_update_ngram_counts(self):
+        """Test occurrences inside longer n-grams are subtracted"""
+        index = nlp.build_ngram_index(u'a b c. a b c. a b. b c d')
+        ngrams = {(u'a', u'b'), (u'b', u'c'), (u'a', u'b', u'c')}
+        self.assertEqual(nlp._update_ngram_counts(ngrams, index),
+                         {u'a b c': 2, u'a b': 1, u'b c': 1})
+
+
+class SentencesTest(TestCase):
+    """Tests sentence splitting used for batch POS tagging"""
+
+    def test_get_sentences(self):
+        """Test sentences are the same as the contexts of n-grams"""
+        text = u'We index text; latent semantic indexing works. Does it? Yes, it does'
+        self.assertEqual(get_sentences(text), [u'We index text;',
+                                               u'latent semantic indexing works.',
+                                               u'Does it?', u'Yes, it does'])
+        for ngram in (u'text', u'latent semantic', u'it'):
+            for context in get_contexts(text, ngram, []):
+                self.assertIn(context, get_sentences(text))
+
+
+class ContextEngineTest(TestCase):
+    """Tests contexts found by the engine are the same as with regular expressions"""
+
+    def test_get_contexts_ngrams(self):
+        """Test plural forms, bigger n-grams and adjacent occurrences"""
+        text = u'Latent semantic models model queries. A latent semantic model-model; ' \
+               u'Queries and latent-semantic indexes, query model model? x-latent semantic'
+        ngrams = [u'latent semantic', u'latent semantic model', u'model', u'query',
+                  u'latent-semantic index', u'semantic']
+        for ngram in ngrams:
+            bigger_ngrams = [b_ngram for b_ngram in ngrams if ngram in b_ngram and b_ngram != ngram]
+            self.assertEqual(list(get_contexts_ngrams(text, ngram, bigger_ngrams)),
+                             list(_get_contexts_ngrams_regex(text, ngram, bigger_ngrams)))
+
+
+class NgramMatcherTest(TestCase):
+    """Tests multi n-gram matching"""
+
+    def test_count(self):
+        """Test counts and offsets are the same as with string methods"""
+        text = u'latent semantic models. semantic model of latent semantic indexing. aaaa'
+        ngrams = [u'latent semantic', u'semantic model', u'model', u'semantic', u'aa', u'missing']
+        matcher = NgramMatcher(ngrams)
+        self.assertEqual(matcher.count(text), dict((ngram, text.count(ngram)) for ngram in ngrams))
+        self.assertEqual(matcher.find_all(text)[u'aa'], [68, 69, 70])
+
+    def test_containing(self):
+        """Test bigger n-grams are found in the given order"""
+        ngrams = [u'semantic model', u'model', u'latent semantic model', u'semantic']
+        self.assertEqual(dict(NgramMatcher(ngrams).containing(ngrams)),
+                         {u'model': [u'semantic model', u'latent semantic model'],
+                          u'semantic': [u'semantic model', u'latent semantic model'],
+                          u'semantic model': [u'latent semantic model']})
+
+
+class StubLookupHandler(BaseHTTPRequestHandler):
+    """DBpedia lookup service failing every first request"""
+    requests = []
+    RESPONSE = '<?xml version="1.0" encoding="utf-8"?>' \
+               '<ArrayOfResult xmlns="http://lookup.dbpedia.org/"><Result>' \
+               '<Label>Latent semantic analysis</Label><Description>LSA</Description>' \
+               '</Result></ArrayOfResult>'
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        if len(self.requests) % 2:
+            self.send_response(503)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.end_headers()
+        self.wfile.write(self.RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+
+class SourceMatcherTest(TestCase):
+    """Tests source matching against a local stub server"""
+
+    def setUp(self):
+        StubLookupHandler.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), StubLookupHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_match(self):
+        """Test failed lookups are retried and results are cached"""
+        url = 'http://127.0.0.1:{0}/KeywordSearch'.format(self.server.server_port)
+        with override_settings(DBPEDIA_LOOKUP_URL=url, DBLP_WSDL_URL=None):
+            matcher = SourceMatcher(threads=0, retries=1, delay=0,
+                                    cache_path=os.path.join(self.tmpdir, 'match.sqlite'))
+            self.assertEqual(matcher.match(u'latent semantic analysis'), ['dbpedia'])
+            self.assertEqual(matcher.match(u'latent semantic analysis'), ['dbpedia'])
+            self.assertEqual(len(StubLookupHandler.requests), 2)
+            self.assertEqual(SourceMatcher(threads=0, cache_path=matcher.cache.path)
+                             .match(u'latent semantic analysis'), ['dbpedia'])
+            self.assertEqual(len(StubLookupHandler.requests), 2)
+
+
+class SQLiteCacheTest(TestCase):
+    """Tests persistent response cache"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_expiration(self):
+        """Test expired and the oldest entries are removed"""
+        cache = SQLiteCache(os.path.join(self.tmpdir, 'cache', 'web.sqlite'), max_entries=2)
+        for i in range(3):
+            cache.set(SQLiteCache.make_key('links', unicode(i)), [i])
+        self.assertEqual(cache.evict(), 1)
+        self.assertIsNone(cache.get(SQLiteCache.make_key('links', u'0')))
+        self.assertEqual(cache.get(SQLiteCache.make_key('links', u'2')), [2])
+        cache.ttl = -1
+        self.assertNotIn(SQLiteCache.make_key('links', u'2'), cache)
+        self.assertEqual(cache.evict(), 2)
+
+    def test_upgrade(self):
+        """Test entries of a table without creation times are kept"""
+        path = os.path.join(self.tmpdir, 'source_match.sqlite')
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        connection.execute('INSERT INTO cache (key, value) VALUES (?, ?)', (u'lsa', '["dbpedia"]'))
+        connection.commit()
+        connection.close()
+        cache = SQLiteCache(path, ttl=60)
+        self.assertEqual(cache.get(u'lsa'), [u'dbpedia'])
+        cache.set(u'plsa', [])
+        self.assertEqual(len(cache), 2)
+
+    def test_seed(self):
+        """Test cache is pre-seeded from a dump"""
+        cache = SQLiteCache(os.path.join(self.tmpdir, 'web.sqlite'))
+        cache.set(SQLiteCache.make_key('categories', u'Latent_semantic_analysis'),
+                  {'categories': [u'Category:Semantics']})
+        dump_path = os.path.join(self.tmpdir, 'dump.json')
+        self.assertEqual(cache.dump(dump_path), 1)
+        seeded = SQLiteCache(os.path.join(self.tmpdir, 'seeded.sqlite'))
+        self.assertEqual(seeded.load(dump_path), 1)
+        self.assertEqual(seeded.get(SQLiteCache.make_key('categories', u'Latent_semantic_analysis')),
+                         {'categories': [u'Category:Semantics']})
+
+
+class StubWikipediaHandler(BaseHTTPRequestHandler):
+    """Wikipedia API returning categories of a small fake category tree"""
+    requests = []
+    CATEGORIES = {
+        u'latent semantic analysis': [u'Category:Semantics', u'Category:Information retrieval'],
+        u'probabilistic model': [u'Category:Statistics', u'Category:Semantics'],
+        u'Category:Semantics': [u'Category:Linguistics'],
+        u'Category:Information retrieval': [u'Category:Semantics', u'Category:Computing'],
+        u'Category:Linguistics': [u'Category:Science'],
+        u'Category:Statistics': [u'Category:Mathematics'],
+        u'Category:Computing': [],
+        u'Category:Mathematics': [],
+    }
+
+    def do_GET(self):
+        title = urlparse.parse_qs(urlparse.urlparse(self.path).query)['titles'][0].decode('utf-8')
+        self.requests.append(title)
+        page = {'title': title}
+        if title in self.CATEGORIES:
+            page['categories'] = [{'title': category} for category in self.CATEGORIES[title]]
+        else:
+            page['missing'] = ''
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(json.dumps({'query': {'pages': {'1': page}}}))
+
+    def log_message(self, *args):
+        pass
+
+
+class CrawlTest(TestCase):
+    """Tests category expansion against a local fake endpoint"""
+
+    def setUp(self):
+        StubWikipediaHandler.requests = []
+        self.server = HTTPServer(('127.0.0.1', 0), StubWikipediaHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.tmpdir = tempfile.mkdtemp()
+        self.response_cache = wiki.response_cache
+        wiki.response_cache = SQLiteCache(os.path.join(self.tmpdir, 'web.sqlite'))
+
+    def tearDown(self):
+        wiki.response_cache = self.response_cache
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_crawl(self):
+        """Test edges are the same as of the depth-first expansion and lookups are not repeated"""
+        def expand(resource):
+            return [(resource, category, 'subject')
+                    for category in wiki.wiki_categories(resource) or []]
+
+        def recurse(resource, depth, edges):
+            if depth:
+                for edge in expand(resource):
+                    edges.add(edge)
+                    recurse(edge[1], depth - 1, edges)
+
+        seeds = [u'latent semantic analysis', u'probabilistic model', u'latent semantic analysis']
+        url = 'http://127.0.0.1:{0}/w/api.php'.format(self.server.server_port)
+        with override_settings(WIKIPEDIA_API_URL=url):
+            edges = wiki.crawl(seeds, expand, 3, workers=4)
+            self.assertEqual(len(StubWikipediaHandler.requests),
+                             len(set(StubWikipediaHandler.requests)))
+            expected = set()
+            for seed in seeds:
+                recurse(seed, 3, expected)
+        self.assertEqual(len(edges), len(set(edges)))
+        self.assertEqual(set(edges), expected)
@@ -1,7 +1,11 @@
+from bisect import bisect_right
+from collections import defaultdict
+import multiprocessing
 import time
 import traceback
 
 from django.conf import settings
+from django.db import connections
 import re
 
 
@@ -25,11 +29,12 @@ def print_timing(func):
         return func
 
 
-def _get_context(text, ngram, start=0):
+def _get_context(text, ngram, start=0, sentence_ends=None):
     """
     Get first encountered context from text, full sentence
     :param ngram: n-gram to search for
     :param start: start of the ngram occurrence, optional
+    :param sentence_ends: precomputed get_sentence_ends(text), optional
     :rtype: str
     """
     if start:
@@ -37,6 +42,11 @@ def _get_context(text, ngram, start=0):
     else:
         ngram = r's? '.join(ngram.split()) + r's?'
         word_start = re.search(ngram, text, re.I).start()
+    if sentence_ends is not None:
+        i = bisect_right(sentence_ends, word_start)
+        context_start = sentence_ends[i - 1] if i else 0
+        context_end = sentence_ends[i] if i < len(sentence_ends) else len(text)
+        return text[context_start:context_end].strip()
     # Check possible punctuations
     context_start = 0
     context_end = len(text)
@@ -50,30 +60,73 @@ def _get_context(text, ngram, start=0):
     return text[context_start:context_end].strip()
 
 
-def get_contexts_ngrams(text, ngram, bigger_ngrams):
+_PUNCT_RE = re.compile(r'[.?;]')
+
+
+def get_sentence_ends(text):
+    """
+    Offsets right after every sentence boundary character, as used by _get_context
+    :type text: unicode
+    :rtype: list
+    """
+    return [match.end() for match in _PUNCT_RE.finditer(text)]
+
+
+def get_sentence_spans(text, sentence_ends=None):
+    """
+    Find the same sentences as _get_context produces
+    :type text: unicode
+    :param sentence_ends: precomputed get_sentence_ends(text), optional
+    :returns: list of (start, end) offsets of the stripped sentences
+    :rtype: list
+    """
+    if sentence_ends is None:
+        sentence_ends = get_sentence_ends(text)
+    spans = []
+    for start, end in zip([0] + list(sentence_ends), list(sentence_ends) + [len(text)]):
+        sentence = text[start:end]
+        start += len(sentence) - len(sentence.lstrip())
+        end -= len(sentence) - len(sentence.rstrip())
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+
+def get_sentences(text):
+    """
+    Split text into the same sentences as _get_context produces
+    :type text: unicode
+    :rtype: list
+    """
+    return [text[start:end] for start, end in get_sentence_spans(text)]
+
+
+def _ngram_plural_regex(ngram):
+    """
+    Regular expression matching ngram with possible plural forms of its words
+    :type ngram: unicode
+    """
+    ngram = ur''.join([x if x in (' ', '-', '') else
+                       ur'({0}|{1})({2}|{3})(s|es)?'.format(x[0], x[0].upper(), x[1:],
+                        x[1:-1]+ur'ies') for x in re.split(r'([\s\-])', ngram)])
+    return ur'(?:[^\w\-]|^)(?P<orig>{0})(?:[^\w\-]|$)'.format(ngram)
+
+
+def _get_contexts_ngrams_regex(text, ngram, bigger_ngrams, sentence_ends=None):
     """
     GENERATOR
-    Get all contexts from the text that do not contain bigger ngrams
+    Get all contexts from the text that do not contain bigger ngrams,
+    matches the text with a regular expression per n-gram
     :returns: a pair (matched_ngram, context)
     :rtype: generator
     """
-    # add possible plural forms
-    def _ngram_plural_regex(ngram):
-        """
-        :type ngram: unicode
-        """
-        ngram = ur''.join([x if x in (' ', '-', '') else
-                           ur'({0}|{1})({2}|{3})(s|es)?'.format(x[0], x[0].upper(), x[1:],
-                            x[1:-1]+ur'ies') for x in re.split(r'([\s\-])', ngram)])
-        return ur'(?:[^\w\-]|^)(?P<orig>{0})(?:[^\w\-]|$)'.format(ngram)
-
     regex_ngram = _ngram_plural_regex(ngram)
     skip_count = 0
     for match in re.finditer(regex_ngram, text, re.U):
         if skip_count:
             skip_count -= 1
             continue
-        context = _get_context(text, ngram, match.start('orig'))
+        context = _get_context(text, ngram, match.start('orig'), sentence_ends)
         # we need to keep ngram count and in the end set the skip count number correctly,
         # because in one sentence there can be multiple occurrences.
         ngram_count = len(re.findall(regex_ngram, context, re.U)) or 1
@@ -96,21 +149,278 @@ def get_contexts_ngrams(text, ngram, bigger_ngrams):
             yield orig_ngram, context
 
 
-def get_contexts(text, ngram, bigger_ngrams):
+_WORD_RE = re.compile(r'\w+', re.U)
+_SIMPLE_NGRAM_RE = re.compile(r'^\w+(?:[ \-]+\w+)*$', re.U)
+
+
+def _ngram_word_forms(word):
+    """
+    Words matched by the plural regular expression of a single n-gram word
+    :type word: unicode
+    :rtype: set
+    """
+    return set([first + rest + suffix for first in (word[0], word[0].upper())
+                for rest in (word[1:], word[1:-1] + u'ies') for suffix in (u'', u's', u'es')])
+
+
+class ContextEngine(object):
+    """
+    Finds contexts of n-grams in a text, gives the same results as matching
+    each n-gram with _ngram_plural_regex.
+
+    The text is split into words and sentences once, n-grams are matched by
+    looking up plural forms of their words in a word index, so all
+    collocations of an article are matched in a single pass over their occurrences.
+    N-grams with characters other than words, spaces and dashes fall back to regular expressions.
+    """
+
+    # engine of the last used text, see for_text
+    _last = None
+
+    def __init__(self, text, sentence_ends=None):
+        """
+        :type text: unicode
+        :param sentence_ends: precomputed get_sentence_ends(text), optional
+        """
+        self.text = text
+        if sentence_ends is None:
+            sentence_ends = get_sentence_ends(text)
+        self.sentence_ends = sentence_ends
+        self.word_starts = []
+        self.word_ends = []
+        self.words = []
+        self.word_index = defaultdict(list)
+        for i, match in enumerate(_WORD_RE.finditer(text)):
+            self.word_starts.append(match.start())
+            self.word_ends.append(match.end())
+            self.words.append(match.group())
+            self.word_index[match.group()].append(i)
+        self._occurrences = {}
+        self._sentence_counts = {}
+        self._sentences = {}
+
+    @classmethod
+    def for_text(cls, text, sentence_ends=None):
+        """
+        Reuse the engine while the same text is processed
+        :type text: unicode
+        :rtype: ContextEngine
+        """
+        engine = cls._last
+        if engine is None or engine.text is not text and engine.text != text:
+            engine = cls._last = cls(text, sentence_ends)
+        return engine
+
+    def add(self, ngrams):
+        """
+        Find occurrences of all new n-grams in one pass over the words they start with
+        :type ngrams: list
+        """
+        text = self.text
+        words = self.words
+        first_forms = defaultdict(list)
+        for ngram in ngrams:
+            if ngram in self._occurrences or not _SIMPLE_NGRAM_RE.match(ngram):
+                continue
+            parts = re.split(r'([ \-]+)', ngram)
+            ngram_forms = [_ngram_word_forms(word) for word in parts[::2]]
+            self._occurrences[ngram] = []
+            for form in ngram_forms[0]:
+                first_forms[form].append((ngram, ngram_forms[1:], parts[1::2]))
+
+        for form, form_ngrams in first_forms.iteritems():
+            for i in self.word_index.get(form, ()):
+                start = self.word_starts[i]
+                if start and text[start - 1] == '-':
+                    continue
+                for ngram, ngram_forms, gaps in form_ngrams:
+                    last = i + len(ngram_forms)
+                    if last >= len(words):
+                        continue
+                    for j, (forms, gap) in enumerate(zip(ngram_forms, gaps), i + 1):
+                        if words[j] not in forms or \
+                                text[self.word_ends[j - 1]:self.word_starts[j]] != gap:
+                            break
+                    else:
+                        end = self.word_ends[last]
+                        if end == len(text) or text[end] != '-':
+                            self._occurrences[ngram].append((start, end))
+        for ngram in set(ngrams):
+            if ngram in self._occurrences:
+                self._occurrences[ngram].sort()
+
+    def _matches(self, ngram, start, end):
+        """
+        Non-overlapping occurrences between start and end, like re.finditer.
+        Boundary characters consumed by a match can not start the next one.
+        :rtype: list
+        """
+        matches = []
+        prev_end = start
+        for match_start, match_end in self._occurrences[ngram]:
+            if match_start < start or match_end > end:
+                continue
+            if match_start == start or match_start - 1 >= prev_end:
+                matches.append((match_start, match_end))
+                prev_end = match_end + 1 if match_end < end else match_end
+        return matches
+
+    def sentence(self, position):
+        """
+        :returns: index, start and end of the stripped sentence containing position,
+        same as _get_context
+        :rtype: tuple
+        """
+        i = bisect_right(self.sentence_ends, position)
+        if i not in self._sentences:
+            start = self.sentence_ends[i - 1] if i else 0
+            end = self.sentence_ends[i] if i < len(self.sentence_ends) else len(self.text)
+            sentence = self.text[start:end]
+            start += len(sentence) - len(sentence.lstrip())
+            end -= len(sentence) - len(sentence.rstrip())
+            self._sentences[i] = (i, start, end)
+        return self._sentences[i]
+
+    def count(self, ngram, sentence):
+        """
+        :param sentence: sentence as returned by ContextEngine.sentence
+        :returns: number of ngram matches in the sentence
+        :rtype: int
+        """
+        if ngram not in self._occurrences:
+            self.add([ngram])
+        key = (ngram, sentence[0])
+        if key not in self._sentence_counts:
+            self._sentence_counts[key] = len(self._matches(ngram, sentence[1], sentence[2]))
+        return self._sentence_counts[key]
+
+    def get_contexts_ngrams(self, ngram, bigger_ngrams):
+        """
+        GENERATOR
+        Same as get_contexts_ngrams for the engine text
+        :returns: a pair (matched_ngram, context)
+        :rtype: generator
+        """
+        bigger_ngrams = list(bigger_ngrams)
+        self.add([ngram] + bigger_ngrams)
+        if ngram not in self._occurrences or \
+                not all(b_ngram in self._occurrences for b_ngram in bigger_ngrams):
+            for result in _get_contexts_ngrams_regex(self.text, ngram, bigger_ngrams,
+                                                     self.sentence_ends):
+                yield result
+            return
+
+        text = self.text
+        skip_count = 0
+        for match_start, match_end in self._matches(ngram, 0, len(text)):
+            if skip_count:
+                skip_count -= 1
+                continue
+            sentence = self.sentence(match_start)
+            context = text[sentence[1]:sentence[2]]
+            count = self.count
+            if not match_start:
+                # _get_context searches for the n-gram again at the very beginning of the text
+                context = _get_context(text, ngram, match_start, self.sentence_ends)
+                if context != text[sentence[1]:sentence[2]]:
+                    count = lambda ngram, sentence: len(re.findall(_ngram_plural_regex(ngram),
+                                                                   context, re.U))
+            # we need to keep ngram count and in the end set the skip count number correctly,
+            # because in one sentence there can be multiple occurrences.
+            ngram_count = count(ngram, sentence) or 1
+            b_ngram_count = 0
+            result = True
+            for b_ngram in bigger_ngrams:
+                b_ngram_count += count(b_ngram, sentence)
+                if b_ngram_count == ngram_count:
+                    result = False
+                    break
+            if result:
+                skip_count = b_ngram_count
+                orig_ngram = text[match_start:match_end]
+                # lower case first letter if it's not title nor acronym
+                if not orig_ngram.istitle() and orig_ngram[0].isupper() and \
+                    not orig_ngram.split()[0].isupper():
+                    orig_ngram2 = orig_ngram[0].lower() + orig_ngram[1:]
+                    context = context.replace(orig_ngram, orig_ngram2)
+                    orig_ngram = orig_ngram2
+                yield orig_ngram, context
+
+
+def get_contexts_ngrams(text, ngram, bigger_ngrams, sentence_ends=None):
+    """
+    GENERATOR
+    Get all contexts from the text that do not contain bigger ngrams
+    :param sentence_ends: precomputed get_sentence_ends(text), optional
+    :returns: a pair (matched_ngram, context)
+    :rtype: generator
+    """
+    return ContextEngine.for_text(text, sentence_ends).get_contexts_ngrams(ngram, bigger_ngrams)
+
+
+def get_contexts(text, ngram, bigger_ngrams, sentence_ends=None):
     """
     GENERATOR
     Get all contexts from the text that do not contain bigger ngrams,
+    :param sentence_ends: precomputed get_sentence_ends(text), optional
     :returns: yields context for ngram without actual ngram (single/plural form)
     :rtype: generator
     """
-    for matched_ngram, context in get_contexts_ngrams(text, ngram, bigger_ngrams):
+    for matched_ngram, context in get_contexts_ngrams(text, ngram, bigger_ngrams, sentence_ends):
         yield context
 
 
-def print_progress(iterable, percent_step=1):
-    total = float(len(iterable))
+def print_progress(iterable, percent_step=1, total=None):
+    """
+    GENERATOR
+    Print percentage of the processed items while iterating
+    :param total: number of items, required if iterable has no length
+    """
+    total = float(len(iterable) if total is None else total)
     abs_step = int((total * percent_step)/100) or 1
     for i, obj in enumerate(iterable):
         if i and not i % abs_step:
             print "{0:.2%} processed".format(i/total)
         yield obj
+
+
+def pool_map(func, iterable, processes=None, chunk_size=100, initializer=None, initargs=(),
+             database=False):
+    """
+    GENERATOR
+    Apply func to every item of iterable in a pool of worker processes, preserving order.
+    Items are consumed in chunks by the calling process, so iterable can lazily read the database,
+    runs in the current process if processes is not set.
+    Workers are forked with the database connection of the calling process and must not use it,
+    unless database is set.
+    :param initializer: called with initargs in every worker before processing
+    :param database: whether workers use the database, connections of the calling process
+    are closed before forking then, so every worker opens its own one
+    :rtype: generator
+    """
+    if not processes:
+        if initializer:
+            initializer(*initargs)
+        for item in iterable:
+            yield func(item)
+        return
+
+    if database:
+        # reopened on the next query by the calling process
+        for connection in connections.all():
+            connection.close()
+    pool = multiprocessing.Pool(processes, initializer, initargs)
+    try:
+        chunk = []
+        for item in iterable:
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                for result in pool.map(func, chunk):
+                    yield result
+                chunk = []
+        for result in pool.map(func, chunk):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
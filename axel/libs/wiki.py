@@ -0,0 +1,176 @@
+"""Wikipedia and DBpedia lookups shared through the persistent response cache"""
+import json
+from multiprocessing.pool import ThreadPool
+import threading
+import time
+from urlparse import urlparse
+
+from django.conf import settings
+import requests
+
+from axel.libs.cache import SQLiteCache
+
+
+response_cache = SQLiteCache(settings.WEB_CACHE_PATH, ttl=settings.WEB_CACHE_TTL,
+                             max_entries=settings.WEB_CACHE_MAX_ENTRIES)
+
+CATEGORY_RELATIONS_QUERY = \
+    u'SELECT ?broader, ?related, ?broaderof WHERE' \
+    u' {{{{ <http://dbpedia.org/resource/{0}> skos:broader ?broader }}' \
+    u' UNION {{ ?broaderof skos:broader <http://dbpedia.org/resource/{0}> }}' \
+    u' UNION {{ ?related skos:related <http://dbpedia.org/resource/{0}> }}' \
+    u' UNION {{ <http://dbpedia.org/resource/{0}> skos:related ?related }}}}'
+
+
+class RateLimiter(object):
+    """Minimal interval between requests to the same host, shared by all threads"""
+
+    def __init__(self, interval):
+        """
+        :param interval: seconds between requests to a host
+        """
+        self.interval = interval
+        self._next_request = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        """Block until a request to the host of the url is allowed"""
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.time()
+            request_time = max(now, self._next_request.get(host, 0))
+            self._next_request[host] = request_time + self.interval
+        if request_time > now:
+            time.sleep(request_time - now)
+
+
+rate_limiter = RateLimiter(settings.WEB_HOST_INTERVAL)
+
+
+def _cached(kind, resource, fetch):
+    """
+    :param kind: type of the lookup, part of the cache key
+    :param fetch: performs the lookup if it is not cached
+    """
+    return response_cache.get_or_set(SQLiteCache.make_key(kind, resource), fetch)
+
+
+def _wiki_query(**params):
+    """
+    :returns: decoded response of the Wikipedia API
+    :rtype: dict
+    """
+    params['format'] = 'json'
+    rate_limiter.wait(settings.WIKIPEDIA_API_URL)
+    response = requests.get(settings.WIKIPEDIA_API_URL, params=params)
+    response.raise_for_status()
+    return json.loads(response.text)
+
+
+def _wiki_page(title, **params):
+    """
+    :returns: first page of the query result
+    :rtype: dict
+    """
+    return _wiki_query(action='query', titles=title, **params)['query']['pages'].values()[0]
+
+
+def wiki_categories(resource):
+    """
+    Visible categories of the Wikipedia page, title cased resource is tried if missing
+    :type resource: unicode
+    :returns: category titles with underscores, None if the page is missing
+    :rtype: list
+    """
+    def fetch():
+        params = {'prop': 'categories', 'cllimit': 50, 'clshow': '!hidden', 'redirects': ''}
+        page = _wiki_page(resource, **params)
+        if 'missing' in page:
+            page = _wiki_page(resource.title(), **params)
+            if 'missing' in page:
+                return {'missing': True}
+        return {'categories': [c['title'].replace(' ', '_') for c in page.get('categories', [])]}
+    return _cached('wiki_categories', resource, fetch).get('categories')
+
+
+def category_relations(category):
+    """
+    Broader, broader-of and related categories of the DBpedia category
+    :type category: unicode
+    :returns: (relation type, related resource) pairs
+    :rtype: list
+    """
+    def fetch():
+        from SPARQLWrapper import SPARQLWrapper, JSON
+        rate_limiter.wait(settings.DBPEDIA_SPARQL_URL)
+        sparql = SPARQLWrapper(settings.DBPEDIA_SPARQL_URL)
+        sparql.setReturnFormat(JSON)
+        sparql.setQuery(CATEGORY_RELATIONS_QUERY.format(category))
+        relations = []
+        for result in sparql.query().convert()['results']['bindings']:
+            for rel_type, value in result.iteritems():
+                relations.append((rel_type, value['value'].split('/')[-1]))
+        return relations
+    return [tuple(relation) for relation in _cached('category_relations', category, fetch)]
+
+
+def wiki_links(title):
+    """
+    :type title: unicode
+    :returns: titles of the pages linked from the Wikipedia page
+    :rtype: list
+    """
+    def fetch():
+        page = _wiki_page(title, prop='links', plnamespace=0, pllimit=500)
+        return [link['title'] for link in page.get('links', [])]
+    return _cached('wiki_links', title, fetch)
+
+
+def wiki_page_html(title):
+    """
+    :type title: unicode
+    :returns: parsed HTML of the Wikipedia page, empty if missing
+    :rtype: unicode
+    """
+    def fetch():
+        result = _wiki_query(action='parse', page=title, redirects='')
+        try:
+            return result['parse']['text']['*']
+        except KeyError:
+            return u''
+    return _cached('wiki_page_html', title, fetch)
+
+
+def crawl(seeds, expand, depth, workers=None):
+    """
+    Breadth-first expansion of the resource graph, every resource is expanded once,
+    at its smallest distance from the seeds. Resources of a level are expanded concurrently.
+    :type seeds: list
+    :param expand: returns (resource, neighbour, relation type) edges of the resource,
+    called from worker threads
+    :param depth: number of expanded levels, seeds are the first one
+    :param workers: number of worker threads, settings.CRAWLER_WORKERS by default
+    :returns: edges in the breadth-first order
+    :rtype: list
+    """
+    level = []
+    seen = set()
+    for resource in seeds:
+        if resource not in seen:
+            seen.add(resource)
+            level.append(resource)
+    edges = []
+    pool = ThreadPool(workers or settings.CRAWLER_WORKERS)
+    try:
+        for _ in range(depth):
+            next_level = []
+            for resource_edges in pool.map(expand, level):
+                for edge in resource_edges:
+                    edges.append(edge)
+                    if edge[1] not in seen:
+                        seen.add(edge[1])
+                        next_level.append(edge[1])
+            level = next_level
+    finally:
+        pool.terminate()
+    return edges
@@ -248,3 +248,30 @@ else:
 TEST_COLLECTION_MODELS = ("axel.articles.models.CSArticleCollocations",
                           "axel.articles.models.SWArticleCollocations")
 BUILD_DBPEDIA_GRAPHS = True
+
+# Matching of new collocations with external sources, see axel.libs.external_match
+DBPEDIA_LOOKUP_URL = 'http://lookup.dbpedia.org/api/search.asmx/KeywordSearch'
+# DBLP lookups are skipped if set to None
+DBLP_WSDL_URL = 'http://dblp.l3s.de/WS/aspl2.php?wsdl'
+# lookups run in the calling thread if set to 0
+SOURCE_MATCH_THREADS = 4
+SOURCE_MATCH_RETRIES = 3
+SOURCE_MATCH_CACHE = ABS_PATH('cache', 'source_match.sqlite')
+
+# Shared cache of Wikipedia and DBpedia responses, see axel.libs.wiki
+WIKIPEDIA_API_URL = 'http://en.wikipedia.org/w/api.php'
+DBPEDIA_SPARQL_URL = 'http://dbpedia.org/sparql'
+WEB_CACHE_PATH = ABS_PATH('cache', 'web.sqlite')
+WEB_CACHE_TTL = 30 * 24 * 3600
+WEB_CACHE_MAX_ENTRIES = 500000
+# seconds between requests to the same host
+WEB_HOST_INTERVAL = 0.1
+# concurrent lookups while building article graphs
+CRAWLER_WORKERS = 8
+
+# In-memory concept autocomplete, see axel.articles.utils.concepts_index
+CONCEPT_AUTOCOMPLETE_RESULTS = 20
+# seconds between rebuilds of a changed index
+CONCEPT_AUTOCOMPLETE_REFRESH = 10
+# touched on changes of the collocations of a cluster, watched by all processes
+CONCEPT_AUTOCOMPLETE_STAMP = ABS_PATH('cache', 'concepts_{0}.stamp')
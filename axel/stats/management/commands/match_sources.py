@@ -0,0 +1,38 @@
+"""Match collocations without source with external sources"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from axel.libs.external_match import SourceMatcher
+from axel.libs.utils import print_progress
+from axel.stats.models import STATS_CLUSTERS_DICT
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option('--cluster', '-c',
+                    action='store',
+                    dest='cluster',
+                    help='cluster id for article type'),
+        make_option('--threads', '-t',
+                    action='store',
+                    dest='threads',
+                    type='int',
+                    help='number of concurrent lookups'),
+    )
+
+    help = 'Matches collocations missed by the background matching, e.g. after a crash'
+
+    def handle(self, *args, **options):
+        cluster_id = options['cluster']
+        if not cluster_id:
+            raise CommandError("need to specify cluster id")
+        model = STATS_CLUSTERS_DICT[cluster_id]
+        collocs = list(model.objects.exclude(_extra_fields__contains='"source"')
+                       .only('id', 'ngram'))
+        print 'Matching {0} collocations...'.format(len(collocs))
+        matcher = SourceMatcher(threads=options['threads'])
+        for colloc in print_progress(collocs):
+            matcher.submit(colloc)
+        matcher.join()
+        print 'Matched'
@@ -1,13 +1,15 @@
 """Match extracted collocation with DBPedia entities"""
 from __future__ import division
-from collections import defaultdict
 from optparse import make_option
+import time
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Sum
 
-from axel.articles.models import CLUSTERS_DICT
-from axel.stats.models import STATS_CLUSTERS_DICT
-from axel.libs.utils import print_progress
+from axel.articles.models import Article, CLUSTERS_DICT, warm_cache_task
+from axel.articles.utils.db import db_cache
+from axel.stats.models import STATS_CLUSTERS_DICT, bulk_create_collocations
+from axel.libs.utils import pool_map, print_progress
 
 
 class Command(BaseCommand):
@@ -16,6 +18,16 @@ class Command(BaseCommand):
                     action='store',
                     dest='cluster',
                     help='cluster id for article type'),
+        make_option('--processes', '-p',
+                    action='store',
+                    dest='processes',
+                    type='int',
+                    help='number of worker processes to tag articles with'),
+        make_option('--yes', '-y',
+                    action='store_true',
+                    dest='yes',
+                    default=False,
+                    help='create new and delete obsolete n-grams without asking'),
     )
 
     help = 'Updates aggregated statistics for the specified cluster, like max POS tag, total counts'
@@ -23,6 +35,8 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
 
         self.cluster_id = cluster_id = options['cluster']
+        self.processes = options['processes']
+        self.yes = options['yes']
         if not cluster_id:
             raise CommandError("need to specify cluster id")
         self.Model = CLUSTERS_DICT[cluster_id].objects
@@ -34,21 +48,29 @@ class Command(BaseCommand):
 
     def _update_total_counts(self):
         print 'Update total counts:'
-        self.StatsModel.all().update(count=0)
-        total_counts = defaultdict(lambda: 0)
-        print 'Collecting new counts...'
-        for ngram, count in print_progress(self.Model.values_list('ngram', 'count'), 10):
-            total_counts[ngram] += count
-        print 'Updating total counts...'
-        for ngram, count in print_progress(total_counts.items(), 5):
-            self.StatsModel.filter(ngram=ngram).update(count=count)
-            self.Model.filter(ngram=ngram).update(total_count=count)
+        time1 = time.time()
+        # stats rows are synchronized by _add_delete_stats, do not create declined ones
+        CLUSTERS_DICT[self.cluster_id].update_counts(create=False)
+        print 'Updated in {0:.3f}s'.format(time.time() - time1)
 
     def _update_max_pos_tags(self):
         print 'Update max POS tags'
+        print 'Tagging articles...'
+        article_ids = list(Article.objects.filter(cluster_id=self.cluster_id)
+                           .values_list('id', flat=True))
+        # tags of an article collocations are written by a single worker
+        tasks = ((self.cluster_id, article_id, ('pos_tag',)) for article_id in article_ids)
+        for _ in print_progress(pool_map(warm_cache_task, tasks, self.processes, database=True),
+                                total=len(article_ids)):
+            pass
+        # aggregate rows are shared by articles, merge cached tags in this process only
         self.StatsModel.all().update(_max_pos_tag=None)
-        for c in print_progress(self.StatsModel.all(), 5):
-            _ = c.max_pos_tag
+        with db_cache.deferred():
+            for c in print_progress(self.StatsModel.all(), 5):
+                _ = c.max_pos_tag
+
+    def _confirm(self, question):
+        return self.yes or raw_input(question + ' (y/n): ') == 'y'
 
     def _add_delete_stats(self):
         cur_ngrams = set(self.Model.values_list('ngram', flat=True))
@@ -56,21 +78,17 @@ class Command(BaseCommand):
         print 'New ngrams:'
         new_ngrams = cur_ngrams.difference(cur_stat_ngrams)
         print new_ngrams
-        if new_ngrams:
-            answer = raw_input('Create new? (y/n): ')
-            if answer == 'y':
-                for ngram in new_ngrams:
-                    count = sum(self.Model.filter(ngram=ngram).values_list('count', flat=True))
-                    stat_ngram = self.StatsModel.create(ngram=ngram, count=count)
-                    _ = stat_ngram.max_pos_tag
-                    self.Model.filter(ngram=ngram).update(total_count=count)
-                print 'Created'
+        if new_ngrams and self._confirm('Create new?'):
+            counts = dict(self.Model.order_by().values_list('ngram').annotate(Sum('count')))
+            # max POS tags are computed for all n-grams in _update_max_pos_tags,
+            # total counts in _update_total_counts
+            bulk_create_collocations(STATS_CLUSTERS_DICT[self.cluster_id],
+                                     dict([(ngram, counts[ngram]) for ngram in new_ngrams]))
+            print 'Created'
 
         print 'Obsolete ngrams:'
         obsolete = cur_stat_ngrams.difference(cur_ngrams)
         print obsolete
-        if obsolete:
-            answer = raw_input('Delete? (y/n): ')
-            if answer == 'y':
-                self.StatsModel.filter(ngram__in=obsolete).delete()
-                print 'Deleted'
+        if obsolete and self._confirm('Delete?'):
+            self.StatsModel.filter(ngram__in=obsolete).delete()
+            print 'Deleted'
@@ -4,11 +4,12 @@ import json
 from collections import defaultdict
 from django.db import models
 from django import forms
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from axel.articles.utils.concepts_index import concepts_changed
 from axel.articles.utils.db import db_cache_simple, db_cache
-from axel.libs.external_match import perform_match
+from axel.libs.external_match import source_matcher
 import axel.stats.scores as scores
 
 
@@ -66,17 +67,14 @@ class Collocation(models.Model):
 
     @property
     def wikipedia_text(self):
-        import requests
         from django.utils.html import strip_tags
-        from axel.libs import nlp
+        from axel.libs import nlp, wiki
         if not 'dbpedia' in self.source:
             return ''
-        query = u'http://en.wikipedia.org/w/api.php?action=parse&page={0}&redirects&format=json'
-        result = json.loads(requests.get(query.format(self.ngram.replace(' ', '_'))).text)
-        try:
-            return nlp.Stemmer.stem_wordnet(strip_tags(result['parse']['text']['*']))
-        except KeyError:
+        html = wiki.wiki_page_html(self.ngram.replace(' ', '_'))
+        if not html:
             return ''
+        return nlp.Stemmer.stem_wordnet(strip_tags(html))
 
     @property
     def count_score(self):
@@ -167,16 +165,47 @@ class SWCollocations(Collocation):
 
 def set_source_field(sender, instance, created, **kwargs):
     """
-    Increment collocation count on create for ArticleCollocation
-    :type instance: ArticleCollocation
+    Queue new collocation for matching with external sources,
+    source is stored in the background
+    :type instance: Collocation
     """
     if kwargs.get('raw'):
         return
     if created:
-        instance.extra_fields = {'source': perform_match(instance)}
-        instance.save_base(raw=True)
+        source_matcher.submit(instance)
+
+
+def bulk_create_collocations(model, counts, batch_size=500):
+    """
+    Create collection collocations with bulk inserts,
+    post_save is sent for every created row afterwards as for the regular create
+    :type model: Collocation
+    :param counts: dict from n-gram to its count
+    """
+    model.objects.bulk_create([model(ngram=ngram, count=count)
+                               for ngram, count in counts.iteritems()], batch_size=batch_size)
+    ngrams = counts.keys()
+    for i in range(0, len(ngrams), batch_size):
+        for colloc in model.objects.filter(ngram__in=ngrams[i:i + batch_size]):
+            post_save.send(sender=model, instance=colloc, created=True, raw=False,
+                           using=colloc._state.db)
+
+
+def refresh_autocomplete(sender, **kwargs):
+    """
+    Rebuild concept autocomplete after collocations are added, counted or deleted
+    :type sender: Collocation
+    """
+    if kwargs.get('raw'):
+        return
+    concepts_changed(sender.CLUSTER_ID)
+
 
 post_save.connect(set_source_field, sender=Collocations)
 post_save.connect(set_source_field, sender=SWCollocations)
+post_save.connect(refresh_autocomplete, sender=Collocations)
+post_save.connect(refresh_autocomplete, sender=SWCollocations)
+post_delete.connect(refresh_autocomplete, sender=Collocations)
+post_delete.connect(refresh_autocomplete, sender=SWCollocations)
 
 STATS_CLUSTERS_DICT = dict([(model.CLUSTER_ID, model) for model in (Collocations, SWCollocations)])
\ No newline at end of file
@@ -1,7 +1,9 @@
 from __future__ import division
 from collections import Counter, defaultdict, OrderedDict
 import re
+import numpy as np
 from axel.articles.models import Article
+from axel.libs.matcher import NgramMatcher
 from axel.libs.nlp import build_ngram_index
 import nltk
 from axel.libs.utils import print_progress
@@ -55,14 +57,17 @@ def C_value_score(collection_ngram, ngram, *args, **kwargs):
 
 
 def linked_score(collection_ngram, ngram, text, article_dict, ngram_abs_count, corr_dict1=None,
-                 corr_dict2=None, score_func='weight_both_ngram4'):
+                 corr_dict2=None, score_func='weight_both_ngram4', tokens=None, distributions=None):
     """
     :type collection_ngram: Collocation
     :type ngram: ArticleCollocation
     :type text: unicode
+    :type tokens: TokenArray
+    :type distributions: dict
     """
     ngram = ngram.ngram
-    nb = NgramBindings(ngram, text, corr_dict1=corr_dict1, corr_dict2=corr_dict2)
+    nb = NgramBindings(ngram, text, corr_dict1=corr_dict1, corr_dict2=corr_dict2, tokens=tokens,
+                       distributions=distributions)
     if len(ngram.split()) == 2:
         score = getattr(nb, score_func)()
     else:
@@ -142,17 +147,188 @@ def linked_score2(collection_ngram, ngram, text, *args, **kwargs):
     return sum(scores) / len(scores), {}, {}
 
 
+class TokenArray(object):
+    """
+    Stemmed text tokenized once into an integer NumPy array.
+
+    Computes the same neighbor distributions as the regular expressions of NgramBindings:
+    wildcards match whole [\w-]+ unicode tokens, the first literal word of a n-gram
+    may end a token and the last one may start a token, matches do not overlap.
+    Positions of every token are grouped by a single argsort, so a distribution
+    only looks at occurrences of the n-gram words instead of scanning the text.
+    """
+
+    def __init__(self, stemmed_text):
+        """
+        :type stemmed_text: unicode
+        """
+        vocabulary = {}
+        tokens = stemmed_text.split()
+        self.ids = np.fromiter((vocabulary.setdefault(token, len(vocabulary))
+                                for token in tokens), dtype=np.int32, count=len(tokens))
+        self.words = sorted(vocabulary, key=vocabulary.get)
+        self.vocabulary = vocabulary
+        is_word = re.compile(ur'^{0}+$'.format(NGRAM_REGEX), re.U).match
+        self.is_word = np.array([bool(is_word(word)) for word in self.words],
+                                dtype=bool)
+        self._positions = np.argsort(self.ids, kind='mergesort')
+        self._offsets = np.searchsorted(self.ids[self._positions],
+                                        np.arange(len(self.words) + 1))
+        self._word_ids_cache = {}
+
+    def _word_ids(self, word, edge=None):
+        """
+        :param edge: 'start' to also match tokens starting with word, 'end' - ending with word
+        :rtype: numpy.ndarray
+        """
+        key = (word, edge)
+        if key not in self._word_ids_cache:
+            if edge == 'start':
+                ids = [i for i, token in enumerate(self.words) if token.startswith(word)]
+            elif edge == 'end':
+                ids = [i for i, token in enumerate(self.words) if token.endswith(word)]
+            else:
+                ids = [self.vocabulary[word]] if word in self.vocabulary else []
+            self._word_ids_cache[key] = np.array(ids, dtype=np.int32)
+        return self._word_ids_cache[key]
+
+    def _occurrences(self, words, offset, first_edge, last_edge):
+        """
+        Find all places where words follow each other in the text
+        :param offset: position of the first word relative to the match start
+        :rtype: numpy.ndarray
+        """
+        last = len(words) - 1
+        ids = self._word_ids(words[0], first_edge if last else first_edge or last_edge)
+        if len(ids):
+            positions = np.concatenate([self._positions[self._offsets[i]:self._offsets[i + 1]]
+                                        for i in ids])
+        else:
+            positions = np.array([], dtype=np.int64)
+        positions = positions[(positions >= offset) & (positions + last < len(self.ids))]
+        for j, word in enumerate(words[1:], 1):
+            token_ids = self.ids[positions + j]
+            if j == last and last_edge:
+                positions = positions[np.in1d(token_ids, self._word_ids(word, last_edge))]
+            elif word in self.vocabulary:
+                positions = positions[token_ids == self.vocabulary[word]]
+            else:
+                return positions[:0]
+        positions.sort()
+        return positions - offset
+
+    def _distribution(self, starts, width, wildcard_offset, length, last_word=None):
+        """
+        Count wildcard words of non-overlapping matches
+        :param starts: sorted match starts
+        :param last_word: last word of the n-gram, when it may be just a prefix of the last token
+        :rtype: Counter
+        """
+        if not len(starts):
+            return Counter()
+        wildcards = self.ids[starts[:, None] + np.arange(wildcard_offset,
+                                                         wildcard_offset + width)]
+        is_word = self.is_word[wildcards].all(axis=1)
+        starts = starts[is_word]
+        wildcards = wildcards[is_word]
+        words = self.words
+        wildcards = [[words[i] for i in row] for row in wildcards.tolist()]
+
+        partial = np.zeros(len(starts), dtype=bool)
+        if last_word is not None:
+            partial = self.ids[starts + length - 1] != self.vocabulary.get(last_word, -1)
+        if partial.any() or len(starts) > 1 and np.diff(starts).min() < length:
+            # re.findall does not return overlapping matches and, when the last word
+            # matched a prefix, continues with the rest of the token as the next wildcard
+            matches = []
+            next_start = 0
+            remainder_at = None
+            for i, start in enumerate(starts.tolist()):
+                if start == remainder_at:
+                    wildcards[i][0] = remainder
+                elif start < next_start:
+                    continue
+                matches.append(wildcards[i])
+                next_start = start + length
+                remainder_at = None
+                if partial[i]:
+                    remainder_at = next_start - 1
+                    remainder = words[self.ids[remainder_at]][len(last_word):]
+            wildcards = matches
+        return Counter([u' '.join(row) for row in wildcards])
+
+    def left_distribution(self, w2, width):
+        """
+        Distribution of `width` words preceding w2
+        :rtype: Counter
+        """
+        words = w2.split()
+        starts = self._occurrences(words, width, None, 'start')
+        return self._distribution(starts, width, 0, width + len(words), words[-1])
+
+    def right_distribution(self, w1, width):
+        """
+        Distribution of `width` words following w1
+        :rtype: Counter
+        """
+        words = w1.split()
+        length = len(words) + width
+        starts = self._occurrences(words, 0, 'end', None)
+        starts = starts[starts + length <= len(self.ids)]
+        return self._distribution(starts, width, len(words), length)
+
+
 class NgramBindings(object):
 
-    def __init__(self, ngram, stemmed_text, corr_dict1=None, corr_dict2=None):
+    def __init__(self, ngram, stemmed_text, corr_dict1=None, corr_dict2=None, tokens=None,
+                 distributions=None):
+        """
+        :param tokens: tokenized stemmed_text to compute distributions with NumPy
+        :type tokens: TokenArray
+        :param distributions: cache of neighbor distributions, shared by all n-grams of the text
+        :type distributions: dict
+        """
         self.values_dict = {}
         self.text = stemmed_text
+        self.tokens = tokens
+        self.distributions = {} if distributions is None else distributions
         self.ngram = ngram
         self.corr_dict1 = corr_dict1 or {}
         self.corr_dict2 = corr_dict2 or {}
         self.ddict1 = {}
         self.ddict2 = {}
 
+    def _left_distribution(self, w2, width, flags=re.U):
+        """
+        :returns: counts of `width` words preceding w2
+        :rtype: Counter
+        """
+        key = ('left', w2, width, flags)
+        if key not in self.distributions:
+            # tokens are split with unicode word semantics only
+            if self.tokens is not None and flags == re.U:
+                self.distributions[key] = self.tokens.left_distribution(w2, width)
+            else:
+                regex = u'(' + u' '.join([NGRAM_REGEX + u'+'] * width) + u') ' + w2
+                self.distributions[key] = Counter(re.findall(regex, self.text, flags))
+        # copy, scores remove entries from the distributions
+        return Counter(self.distributions[key])
+
+    def _right_distribution(self, w1, width, flags=re.U):
+        """
+        :returns: counts of `width` words following w1
+        :rtype: Counter
+        """
+        key = ('right', w1, width, flags)
+        if key not in self.distributions:
+            # tokens are split with unicode word semantics only
+            if self.tokens is not None and flags == re.U:
+                self.distributions[key] = self.tokens.right_distribution(w1, width)
+            else:
+                regex = w1 + u' (' + u' '.join([NGRAM_REGEX + u'+'] * width) + u')'
+                self.distributions[key] = Counter(re.findall(regex, self.text, flags))
+        return Counter(self.distributions[key])
+
     def weight_both_ngram1(self, split_ngram=None):
         """AVERAGE BETWEEN TWO WEIGHTED SCORES"""
         ngram = self.ngram
@@ -164,11 +340,11 @@ class NgramBindings(object):
             if space_index == -1:
                 break
             w1, w2 = ngram[:space_index], ngram[space_index + 1:]
-            distribution_dict = Counter(re.findall(ur'({1}+) {0}'.format(w2, NGRAM_REGEX, re.U), self.text))
+            distribution_dict = self._left_distribution(w2, 1, flags=0)
             N1 = sum(distribution_dict.values())
             N1_len = len(distribution_dict)
             score += distribution_dict[w1]
-            distribution_dict = Counter(re.findall(ur'{0} ({1}+)'.format(w1, NGRAM_REGEX, re.U), self.text))
+            distribution_dict = self._right_distribution(w1, 1, flags=0)
             N2 = sum(distribution_dict.values())
             N2_len = len(distribution_dict)
             score += distribution_dict[w2]
@@ -187,11 +363,11 @@ class NgramBindings(object):
             if space_index == -1:
                 break
             w1, w2 = ngram[:space_index], ngram[space_index + 1:]
-            distribution_dict = Counter(re.findall(ur'({1}+) {0}'.format(w2, NGRAM_REGEX), self.text, re.U))
+            distribution_dict = self._left_distribution(w2, 1)
             N2 = sum(distribution_dict.values())
             N2_len = len(distribution_dict)
             score1 = distribution_dict[w1]
-            distribution_dict = Counter(re.findall(ur'{0} ({1}+)'.format(w1, NGRAM_REGEX), self.text, re.U))
+            distribution_dict = self._right_distribution(w1, 1)
             N1 = sum(distribution_dict.values())
             N1_len = len(distribution_dict)
             score2 = distribution_dict[w2]
@@ -218,14 +394,12 @@ class NgramBindings(object):
             if split_ngram and w1 != split_ngram and not w2 != split_ngram:
                 continue
             # subtract existing prefixes/suffixes from distribution dicts
-            regex = u'(' + (ur'{0}+ '.format(NGRAM_REGEX) * len(w1.split()))[:-1] + u') ' + w2
-            distribution_dict = Counter(re.findall(regex, self.text, re.U))
+            distribution_dict = self._left_distribution(w2, len(w1.split()))
             N2 = sum(distribution_dict.values())
             N2_len = len(distribution_dict)
             score1 = distribution_dict[w1]
 
-            regex = w1 + u' (' + (ur' {0}+'.format(NGRAM_REGEX) * len(w2.split()))[1:] + u')'
-            distribution_dict = Counter(re.findall(regex, self.text, re.U))
+            distribution_dict = self._right_distribution(w1, len(w2.split()))
             N1 = sum(distribution_dict.values())
             N1_len = len(distribution_dict)
             score2 = distribution_dict[w2]
@@ -249,8 +423,7 @@ class NgramBindings(object):
             if split_ngram and w1 != split_ngram and not w2 != split_ngram:
                 continue
             # subtract existing prefixes/suffixes from distribution dicts
-            regex = u'(' + (ur'{0}+ '.format(NGRAM_REGEX) * len(w1.split()))[:-1] + u') ' + w2
-            self.ddict1 = distribution_dict = Counter(re.findall(regex, self.text, re.U))
+            self.ddict1 = distribution_dict = self._left_distribution(w2, len(w1.split()))
             if w2 in self.corr_dict1:
                 for w in self.corr_dict1[w2]:
                     if w != w1:
@@ -259,8 +432,7 @@ class NgramBindings(object):
             N2_len = len(distribution_dict)
             score1 = distribution_dict[w1]
 
-            regex = w1 + u' (' + (ur' {0}+'.format(NGRAM_REGEX) * len(w2.split()))[1:] + u')'
-            self.ddict2 = distribution_dict = Counter(re.findall(regex, self.text, re.U))
+            self.ddict2 = distribution_dict = self._right_distribution(w1, len(w2.split()))
             if w1 in self.corr_dict2:
                 for w in self.corr_dict2[w1]:
                     if w != w2:
@@ -275,9 +447,10 @@ class NgramBindings(object):
         return score / denominator
 
 
-def populate_article_dict(model, score_func, cutoff=1):
+def populate_article_dict(model, score_func, cutoff=1, vectorized=True):
     """
     :type model: Model
+    :param vectorized: compute n-gram bindings over a token array instead of regular expressions
     """
     article_dict = defaultdict(dict)
     article_rel_dict = defaultdict(dict)
@@ -288,10 +461,17 @@ def populate_article_dict(model, score_func, cutoff=1):
 
     for article in print_progress(Article.objects.filter(cluster_id=model.CLUSTER_ID)):
         text = article.stemmed_text
+        tokens = TokenArray(text) if vectorized else None
+        # neighbor distributions are shared by n-grams with the same words
+        distributions = {}
         # create correspondence dict
         corr_dict1 = defaultdict(set)
         corr_dict2 = defaultdict(set)
         all_ngrams = list(model.objects.filter(article=article).values_list('ngram', flat=True))
+        # count all n-grams in the text and in each other in one pass
+        matcher = NgramMatcher(all_ngrams)
+        abs_counts = matcher.count(text)
+        containing = matcher.containing(all_ngrams)
         for ngram in all_ngrams:
             if len(ngram.split()) == 2:
                 w1, w2 = ngram.split()
@@ -299,20 +479,18 @@ def populate_article_dict(model, score_func, cutoff=1):
                 corr_dict2[w1].add(w2)
         for ngram in sorted(model.objects.filter(article=article),
                             key=lambda x: len(x.ngram.split())):
-            part_count = 0
-            for p_ngram in all_ngrams:
-                if p_ngram != ngram.ngram and ngram.ngram in p_ngram:
-                    part_count += 1
+            part_count = len(containing[ngram.ngram])
             try:
                 is_rel = article_rel_dict[unicode(article)][ngram.ngram]
             except KeyError:
                 continue
-            ngram_abs_count = text.count(ngram.ngram)
+            ngram_abs_count = abs_counts[ngram.ngram]
             if ngram_abs_count <= cutoff:
                 continue
             collection_ngram = model.COLLECTION_MODEL.objects.get(ngram=ngram.ngram)
             score, ddict1, ddict2 = score_func(collection_ngram, ngram, text, article_dict[article],
-                                               ngram_abs_count, corr_dict1, corr_dict2)
+                                               ngram_abs_count, corr_dict1, corr_dict2,
+                                               tokens=tokens, distributions=distributions)
             nl_ngrams = [' '.join(n) for n in nltk.ngrams(ngram.ngram.split(), 2)]
             support_len = len(set(all_ngrams).intersection(nl_ngrams))
             article_dict[article][ngram.ngram] = {'abs_count': ngram_abs_count, 'score': score,
@@ -341,17 +519,18 @@ def populate_article_dict_ML(model, cutoff=1):
         text = article.stemmed_text
         # create correspondence dict
         all_ngrams = list(model.objects.filter(article=article).values_list('ngram', flat=True))
+        # count all n-grams in the text and in each other in one pass
+        matcher = NgramMatcher(all_ngrams)
+        abs_counts = matcher.count(text)
+        containing = matcher.containing(all_ngrams)
         for ngram in sorted(model.objects.filter(article=article),
                             key=lambda x: len(x.ngram.split())):
-            part_count = 0
-            for p_ngram in all_ngrams:
-                if p_ngram != ngram.ngram and ngram.ngram in p_ngram:
-                    part_count += 1
+            part_count = len(containing[ngram.ngram])
             try:
                 is_rel = article_rel_dict[unicode(article)][ngram.ngram]
             except KeyError:
                 continue
-            ngram_abs_count = text.count(ngram.ngram)
+            ngram_abs_count = abs_counts[ngram.ngram]
             if ngram_abs_count <= cutoff:
                 continue
             collection_ngram = model.COLLECTION_MODEL.objects.get(ngram=ngram.ngram)
@@ -3,7 +3,6 @@
 from __future__ import division
 
 from collections import defaultdict
-import json
 import math
 import nltk
 
@@ -104,7 +103,7 @@ class NgramMeasureScoring:
         df_dict = dict(queryset.values_list('ngram', '_df_score'))
         total_docs = Article.objects.filter(cluster_id=queryset.model.CLUSTER_ID).count()
         for article in print_progress(Article.objects.filter(cluster_id=queryset.model.CLUSTER_ID)):
-            index = json.loads(article.index)
+            index = article.index
             # add TF-IDF score
             ngrams = article.articlecollocation_set.values_list('ngram', 'count')
             tfidf_ordering = [(ngram, score * math.log(total_docs / df_dict[ngram]))
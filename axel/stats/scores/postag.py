@@ -1,8 +1,114 @@
 """Part-of-speech calculation"""
 from collections import defaultdict
+from itertools import izip
+import re
 import nltk
 
 from axel.libs.nlp import Stemmer
+from axel.libs.utils import get_sentence_spans
+
+# batch tagging is called batch_pos_tag before NLTK 3.0
+_pos_tag_sents = getattr(nltk, 'pos_tag_sents', None) or nltk.batch_pos_tag
+# same as nltk.regexp_tokenize, but provides offsets
+_TOKEN_RE = re.compile(Stemmer.TOKENIZE_REGEXP, re.UNICODE | re.MULTILINE | re.DOTALL)
+
+
+class TaggedSentences(object):
+    """
+    POS tags of text sentences, all sentences are tagged in a single batch.
+    Contexts are looked up by their text, the ones not seen before
+    (for example with a lower-cased first letter) are tagged on demand.
+    """
+
+    def __init__(self, text, spans, tags=None):
+        """
+        :param spans: (start, end) offsets of the sentences in the text
+        :param tags: already known tags by sentence, the rest of sentences is tagged
+        :type tags: dict
+        """
+        self.text = text
+        self.spans = spans
+        self.tags = tags or {}
+        self.tag([text[start:end] for start, end in spans])
+
+    @classmethod
+    def from_text(cls, text, sentence_ends=None):
+        """
+        :type text: unicode
+        :param sentence_ends: precomputed sentence boundaries of the text, optional
+        :rtype: TaggedSentences
+        """
+        return cls(text, get_sentence_spans(text, sentence_ends))
+
+    @classmethod
+    def from_rows(cls, text, rows):
+        """
+        Restore tagged sentences stored with rows()
+        :type text: unicode
+        :rtype: TaggedSentences
+        """
+        spans = []
+        tags = {}
+        for start, end, offsets, sentence_tags in rows:
+            sentence = text[start:end]
+            spans.append((start, end))
+            tags[sentence] = [(sentence[offsets[2 * i]:offsets[2 * i + 1]], tag)
+                              for i, tag in enumerate(sentence_tags)]
+        return cls(text, spans, tags)
+
+    def rows(self):
+        """
+        Compact representation for storage
+        :returns: list of [start, end, token offsets in the sentence, tags]
+        :rtype: list
+        """
+        rows = []
+        for start, end in self.spans:
+            offsets = []
+            for match in _TOKEN_RE.finditer(self.text, start, end):
+                offsets.extend((match.start() - start, match.end() - start))
+            rows.append([start, end, offsets,
+                         [tag for _, tag in self.tags[self.text[start:end]]]])
+        return rows
+
+    def sentences(self):
+        """
+        GENERATOR
+        :returns: sentences of the text with their tags in order
+        """
+        for start, end in self.spans:
+            sentence = self.text[start:end]
+            yield sentence, self.tags[sentence]
+
+    def tag(self, sentences):
+        """
+        Tag new sentences at once
+        :type sentences: list
+        """
+        sentences = [sentence for sentence in set(sentences) if sentence not in self.tags]
+        if sentences:
+            tagged = _pos_tag_sents([nltk.regexp_tokenize(sentence, Stemmer.TOKENIZE_REGEXP)
+                                     for sentence in sentences])
+            self.tags.update(izip(sentences, tagged))
+
+    def __getitem__(self, sentence):
+        """
+        :returns: list of (word, tag) pairs
+        :rtype: list
+        """
+        if sentence not in self.tags:
+            self.tag([sentence])
+        return self.tags[sentence]
+
+
+def _tag_context(context, tagged=None):
+    """
+    :type tagged: TaggedSentences
+    :rtype: list
+    """
+    if tagged is not None:
+        return tagged[context]
+    return nltk.pos_tag(nltk.regexp_tokenize(context, Stemmer.TOKENIZE_REGEXP))
 
 
 def compress_pos_tag(max_ngram, rules_dict):
@@ -17,11 +123,13 @@ def compress_pos_tag(max_ngram, rules_dict):
     return max_ngram
 
 
-def pos_tag_pos(ngram, contexts, tag_pos=-1):
+def pos_tag_pos(ngram, contexts, tag_pos=-1, tagged=None):
     """
     Identifies POS tag for the ngram in each context and returns the corresponding dict with counts
     :type ngram: unicode
     :type contexts: list
+    :param tagged: already tagged sentences of the text
+    :type tagged: TaggedSentences
     :rtype: dict
     When ngram is right at the beginning of the sentence, this code actually takes the last (-1)
     POS tag, which happens to be a punctuation mark.
@@ -36,8 +144,7 @@ def pos_tag_pos(ngram, contexts, tag_pos=-1):
         words, context = context
         words = tuple(words.split())
         tag = None
-        tags = [(word, tag)
-                for word, tag in nltk.pos_tag(nltk.regexp_tokenize(context, Stemmer.TOKENIZE_REGEXP))]
+        tags = [(word, tag) for word, tag in _tag_context(context, tagged)]
         for j, wordtag in enumerate(tags):
             if wordtag[0] == words[0] and tuple(zip(*tags)[0][j:j+ngram_len]) == words:
                 try:
@@ -51,11 +158,13 @@ def pos_tag_pos(ngram, contexts, tag_pos=-1):
     return ngram_tags.items()
 
 
-def pos_tag(ngram, contexts):
+def pos_tag(ngram, contexts, tagged=None):
     """
     Identifies POS tag for the ngram in each context and returns the MAX probable
     :type ngram: unicode
     :type contexts: list
+    :param tagged: already tagged sentences of the text
+    :type tagged: TaggedSentences
     :rtype: list
     """
     ngram_tags = defaultdict(lambda: 0)
@@ -65,8 +174,7 @@ def pos_tag(ngram, contexts):
     for i, context in enumerate(contexts):
         words, context = context
         words = tuple(words.split())
-        tags = [(word, tag)
-                for word, tag in nltk.pos_tag(nltk.regexp_tokenize(context, Stemmer.TOKENIZE_REGEXP))
+        tags = [(word, tag) for word, tag in _tag_context(context, tagged)
                 if word in set(words)]
         for j, wordtag in enumerate(tags):
             if wordtag[0] == words[0] and tuple(zip(*tags)[0][j:j+ngram_len]) == words:
@@ -0,0 +1,59 @@
+"""Unit-tests for stats app"""
+import re
+
+from django.test import TestCase
+
+from axel.stats.scores.binding_scores import NgramBindings, TokenArray
+
+
+class TokenArrayTest(TestCase):
+    """Tests vectorized n-gram bindings against the regular expression ones"""
+
+    TEXT = u'a latent semantic model . the semantic model of data model , data models ' \
+           u'xmodel and semantic modeling model model'
+
+    def test_distributions(self):
+        """Test neighbor distributions are the same including partial word matches"""
+        tokens = TokenArray(self.TEXT)
+        nb = NgramBindings(u'semantic model', self.TEXT)
+        for words in (u'model', u'semantic model', u'a', u'data model', u'missing'):
+            for width in (1, 2):
+                self.assertEqual(tokens.left_distribution(words, width),
+                                 nb._left_distribution(words, width))
+                self.assertEqual(tokens.right_distribution(words, width),
+                                 nb._right_distribution(words, width))
+
+    def test_scores(self):
+        """Test both backends give the same scores and distribution dicts"""
+        tokens = TokenArray(self.TEXT)
+        for ngram in (u'semantic model', u'latent semantic model', u'data model'):
+            for score_func in ('weight_both_ngram1', 'weight_both_ngram2', 'weight_both_ngram3',
+                               'weight_both_ngram4'):
+                nb = NgramBindings(ngram, self.TEXT)
+                nb_tokens = NgramBindings(ngram, self.TEXT, tokens=tokens)
+                self.assertEqual(getattr(nb, score_func)(), getattr(nb_tokens, score_func)())
+                self.assertEqual(nb.ddict1, nb_tokens.ddict1)
+                self.assertEqual(nb.ddict2, nb_tokens.ddict2)
+
+    def test_non_unicode_flags(self):
+        """Test distributions without re.U match the regular expressions on non-ASCII text"""
+        text = u'na\xefve model and na\xefve model'
+        nb = NgramBindings(u'na\xefve model', text)
+        nb_tokens = NgramBindings(u'na\xefve model', text, tokens=TokenArray(text))
+        self.assertEqual(nb_tokens._left_distribution(u'model', 1, flags=0),
+                         nb._left_distribution(u'model', 1, flags=0))
+        self.assertEqual(nb_tokens.weight_both_ngram1(), nb.weight_both_ngram1())
+
+    def test_shared_distributions(self):
+        """Test cached distributions are reused and not modified by the scores"""
+        distributions = {}
+        corr_dict1 = {u'model': {u'semantic', u'data'}}
+        corr_dict2 = {u'semantic': {u'model', u'modeling'}}
+        for ngram in (u'semantic model', u'data model', u'semantic model'):
+            nb = NgramBindings(ngram, self.TEXT, corr_dict1, corr_dict2,
+                               distributions=distributions)
+            score = nb.weight_both_ngram4()
+            self.assertEqual(score, NgramBindings(ngram, self.TEXT, corr_dict1,
+                                                  corr_dict2).weight_both_ngram4())
+        self.assertEqual(distributions[('left', u'model', 1, re.U)][u'data'], 2)
+        self.assertEqual(len(distributions), 3)
@@ -23,6 +23,9 @@ environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+from axel.articles.utils.concepts_index import load_autocompletes
+load_autocompletes()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)